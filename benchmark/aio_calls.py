@@ -0,0 +1,81 @@
+"""
+多连接并发调用吞吐: 每个连接一个接收线程的 InstrumentRPC 与单事件循环的 AsyncInstrumentRPC 对比
+服务端为 benchmark/fakeserver.py, 每个调用模拟 latency 秒的设备处理时间
+用法: python benchmark/aio_calls.py [连接数]
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from threading import Thread
+
+sys.path.append(os.getcwd())
+from benchmark.fakeserver import FakeDTXServer, get_fake_async_rpc, get_fake_rpc
+from instrument.RPC import pre_call
+from instrument.aio import pre_call as async_pre_call
+
+CHANNEL = "com.apple.instruments.server.services.deviceinfo"
+LATENCY = 0.002
+CALLS = 200
+
+
+def run_threads(port, connections):
+    rpcs = []
+    for _ in range(connections):
+        rpc = get_fake_rpc(port)
+        pre_call(rpc)
+        rpcs.append(rpc)
+
+    def worker(rpc):
+        for _ in range(CALLS):
+            rpc.call(CHANNEL, "runningProcesses")
+
+    threads = [Thread(target=worker, args=(rpc,)) for rpc in rpcs]
+    begin = time.perf_counter()
+    for t in threads:
+        t.start()
+    peak_threads = threading.active_count()
+    for t in threads:
+        t.join()
+    cost = time.perf_counter() - begin
+    for rpc in rpcs:
+        rpc.deinit()
+        rpc.stop()
+    return connections * CALLS / cost, peak_threads
+
+
+async def run_async(port, connections, concurrency):
+    rpcs = []
+    for _ in range(connections):
+        rpc = await get_fake_async_rpc(port)
+        await async_pre_call(rpc)
+        rpcs.append(rpc)
+
+    async def worker(rpc):
+        for _ in range(CALLS // concurrency):
+            await rpc.call(CHANNEL, "runningProcesses")
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(worker(rpc) for rpc in rpcs for _ in range(concurrency)))
+    cost = time.perf_counter() - begin
+    for rpc in rpcs:
+        await rpc.deinit()
+    return connections * CALLS / cost, threading.active_count()
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    server = FakeDTXServer(latency=LATENCY)
+    port = server.serve_in_thread()
+    rate, threads = run_threads(port, connections)
+    print(f"InstrumentRPC      {connections} connections x 1 caller : {rate:9.0f} calls/s, {threads} threads")
+    for concurrency in (1, 8):
+        rate, threads = asyncio.run(run_async(port, connections, concurrency))
+        print(f"AsyncInstrumentRPC {connections} connections x {concurrency} caller : {rate:9.0f} calls/s, "
+              f"{threads} threads")
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
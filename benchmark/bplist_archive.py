@@ -0,0 +1,48 @@
+"""
+NSKeyedArchive 编码吞吐: InstrumentRPC._call 中 selector 与 auxiliary 常见的归档数据, 输出每次耗时与 MB/s (按输出字节计)
+用法: python benchmark/bplist_archive.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import SYSMONTAP_PROC_ATTRS, SYSMONTAP_SYS_ATTRS
+from instrument.bpylist import archiver
+
+SYSMON_CONFIG = {'ur': 1000, 'bm': 0, 'procAttrs': SYSMONTAP_PROC_ATTRS, 'sysAttrs': SYSMONTAP_SYS_ATTRS,
+                 'cpuUsage': True, 'sampleInterval': 1000000000}
+LAUNCH_OPTIONS = {'StartSuspendedKey': 0, 'KillExisting': 1,
+                  'environment': {f'ENV_{i}': f'value-{i}' * 4 for i in range(64)},
+                  'arguments': [f'-argument{i}' for i in range(32)]}
+
+PAYLOADS = [
+    ('selector', "launchSuspendedProcessWithDevicePath:bundleIdentifier:environment:arguments:options:"),
+    ('channel identifier', "com.apple.instruments.server.services.sysmontap"),
+    ('sysmontap setConfig:', SYSMON_CONFIG),
+    ('launch options', LAUNCH_OPTIONS),
+    ('NSArray 2000 strings', [f'/private/var/containers/Bundle/Application/{i:08d}' for i in range(2000)]),
+    ('NSArray 20000 strings', [f'/private/var/containers/Bundle/Application/{i:08d}' for i in range(20000)]),
+]
+
+
+def measure(func, obj, min_time=0.5):
+    rounds = 0
+    begin = time.perf_counter()
+    while 1:
+        func(obj)
+        rounds += 1
+        cost = time.perf_counter() - begin
+        if cost >= min_time:
+            return cost / rounds
+
+
+def main():
+    for name, obj in PAYLOADS:
+        size = len(archiver.archive(obj))
+        cost = measure(archiver.archive, obj)
+        print(f"{name:22s} {size:8d} bytes  {cost * 1000:9.3f} ms  {size / cost / 2 ** 20:7.2f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+bplist 读取: 对 sysmontap 与 networking 消息的 NSKeyedArchive 调用 load, 输出每条耗时与吞吐, 以 plistlib.loads 作参照
+用法: python benchmark/bplist_read.py [进程数]
+"""
+import os
+import plistlib
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import networking_payloads, ns_keyed_archive, sysmontap_payload
+from instrument.bpylist.bplistlib.readwrite import load
+
+
+def measure(func, payloads, min_time=1.0):
+    rounds = 0
+    begin = time.perf_counter()
+    while 1:
+        for payload in payloads:
+            func(payload)
+        rounds += 1
+        cost = time.perf_counter() - begin
+        if cost >= min_time:
+            return cost / rounds / len(payloads)
+
+
+def main():
+    process_count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    samples = [
+        (f'sysmontap {process_count} procs', [ns_keyed_archive(sysmontap_payload(process_count, seed))
+                                             for seed in range(4)]),
+        ('sysmontap 50 procs', [ns_keyed_archive(sysmontap_payload(50, seed)) for seed in range(4)]),
+        ('networking', [ns_keyed_archive(payload) for payload in networking_payloads()]),
+    ]
+    for name, payloads in samples:
+        size = sum(map(len, payloads)) / len(payloads)
+        ours = measure(load, payloads)
+        ref = measure(plistlib.loads, payloads)
+        print(f"{name:22s} {size / 1024:8.1f} KiB  load {ours * 1000:9.3f} ms {size / ours / 2 ** 20:7.1f} MB/s   "
+              f"plistlib {ref * 1000:9.3f} ms {size / ref / 2 ** 20:7.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
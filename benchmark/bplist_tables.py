@@ -0,0 +1,50 @@
+"""
+bplist 偏移表与引用列表解码: 对象数在 5 万以上的 bplist, 分别统计偏移表解码 (read_table) 与完整 load 的耗时
+1.6 万个字符串的数组, 由 generate 写出 (3 字节偏移) 与 plistlib 写出 (4 字节偏移)
+2.3 万个键的字典
+3.大量进程的 sysmontap NSKeyedArchive, 超过 65535 个对象时使用 4 字节引用
+用法: python benchmark/bplist_tables.py [进程数]
+"""
+import os
+import plistlib
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import ns_keyed_archive, sysmontap_payload
+from instrument.bpylist.bplistlib.readwrite import generate, load, read_table, read_trailer
+
+
+def measure(func, min_time=1.0):
+    rounds = 0
+    begin = time.perf_counter()
+    while 1:
+        func()
+        rounds += 1
+        cost = time.perf_counter() - begin
+        if cost >= min_time:
+            return cost / rounds
+
+
+def main():
+    process_count = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+    strings = [f'process-{i:06d}' for i in range(60000)]
+    keys = {f'key-{i:06d}': i * 7 for i in range(30000)}
+    samples = [
+        ('60k strings', generate(strings)),
+        ('60k strings (plistlib)', plistlib.dumps(strings, fmt=plistlib.FMT_BINARY)),
+        ('30k keys', generate(keys)),
+        ('30k keys (plistlib)', plistlib.dumps(keys, fmt=plistlib.FMT_BINARY)),
+        (f'sysmontap {process_count} procs', ns_keyed_archive(sysmontap_payload(process_count, 0))),
+    ]
+    for name, payload in samples:
+        buffer = memoryview(payload)
+        offset_size, reference_size, length, root, table_offset = read_trailer(buffer)
+        table = measure(lambda: read_table(buffer, offset_size, length, table_offset))
+        full = measure(lambda: load(payload))
+        print(f"{name:24s} {length:7d} objects  ref {reference_size}  offset {offset_size}  "
+              f"table {table * 1000:8.3f} ms  load {full * 1000:9.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
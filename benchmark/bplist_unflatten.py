@@ -0,0 +1,55 @@
+"""
+bplist unflatten: 被多处引用的字符串, 整数, uid 等对象只构建一次, 统计 load 的耗时, 内存峰值与结果占用的内存块数
+1.sysmontap 消息的 NSKeyedArchive
+2.每个进程一个字典的 sysmontap 采样 (plistlib 写出), 所有字典共享同一组键
+用法: python benchmark/bplist_unflatten.py
+"""
+import os
+import plistlib
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import SYSMONTAP_PROC_ATTRS, ns_keyed_archive, sysmontap_payload
+from instrument.bpylist.bplistlib.readwrite import load
+
+
+def bench_load(payload, rounds=20):
+    load(payload)
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        load(payload)
+    per_message = (time.perf_counter() - begin) / rounds
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    plist = load(payload)
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    del plist
+    return per_message, peak - base, current - base, blocks
+
+
+def process_rows(process_count):
+    processes = sysmontap_payload(process_count, 0)[0]['DTTapMessagePlist']['Processes']
+    rows = [dict(zip(SYSMONTAP_PROC_ATTRS, row)) for row in processes.values()]
+    return plistlib.dumps(rows, fmt=plistlib.FMT_BINARY)
+
+
+def main():
+    for process_count in (50, 400, 1200):
+        for name, payload in [('archive', ns_keyed_archive(sysmontap_payload(process_count, 0))),
+                              ('rows', process_rows(process_count))]:
+            per_message, peak, retained, blocks = bench_load(payload)
+            print(f"{name:8s}{process_count:5d} procs {len(payload):8d} bytes: {per_message * 1000:8.2f} ms/msg  "
+                  f"peak {peak / 1024:8.1f} KiB  retained {retained / 1024:8.1f} KiB  blocks {blocks}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+bplist 写入的规模曲线: 对象数从 10 到 100k 时 generate 的耗时, 去重与引用查找为线性时每个对象的耗时应保持不变
+样本为一半字符串一半整数的数组, 约 1/4 的字符串与 1/2 的整数重复出现, 另外输出 archiver.archive 一个大 NSArray 的耗时
+用法: python benchmark/bplist_write.py [最大对象数]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from instrument.bpylist import archiver
+from instrument.bpylist.bplistlib.readwrite import generate
+
+SIZES = (10, 100, 1000, 10000, 100000)
+
+
+def payload(count):
+    half = count // 2
+    return ([f'procAttr{i % max(half // 2, 1)}' for i in range(half)] +
+            [300000 + i % max(half // 2, 1) for i in range(count - half)])
+
+
+def measure(func, obj, min_time=0.5):
+    rounds = 0
+    begin = time.perf_counter()
+    while 1:
+        func(obj)
+        rounds += 1
+        cost = time.perf_counter() - begin
+        if cost >= min_time:
+            return cost / rounds
+
+
+def main():
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+    for count in SIZES:
+        if count > max_size:
+            break
+        obj = payload(count)
+        cost = measure(generate, obj)
+        print(f"generate         {count:7d} items: {cost * 1000:10.2f} ms  {cost / count * 1e6:7.2f} us/item")
+    for count in SIZES:
+        if count > min(max_size, 10000):
+            break
+        # NSKeyedArchive 中每个字符串都是单独的对象, 数组元素全部变成 uid 引用
+        obj = [f'process{i}' for i in range(count)]
+        cost = measure(archiver.archive, obj)
+        print(f"archiver.archive {count:7d} items: {cost * 1000:10.2f} ms  {cost / count * 1e6:7.2f} us/item")
+
+
+if __name__ == '__main__':
+    main()
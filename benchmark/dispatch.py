@@ -0,0 +1,81 @@
+"""
+回调分发: 在接收线程中执行回调与线程池分发的对比
+抓包中 opengl channel 的消息回调很快, sysmontap channel 的回调模拟 5ms 的数据库写入
+输出接收线程读完所有数据的耗时, 两个 channel 最后一个回调完成的时间, 以及各 channel 的丢弃数与最大队列深度
+用法: python benchmark/dispatch.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import OPENGL_CHANNEL, SYSMONTAP_CHANNEL, channel_request_wire, opengl_wire, \
+    sysmontap_message
+from instrument.RPC import get_replay_rpc
+from instrument.capture import DTXCaptureWriter, DIRECTION_RECV, DIRECTION_SEND
+from instrument.dispatch import DISPATCH_BLOCK, DISPATCH_DROP_OLDEST, DISPATCH_DROP_NEWEST
+
+OPENGL_MESSAGES = 1000
+SYSMONTAP_MESSAGES = 200
+SLOW_CALLBACK = 0.005
+
+
+def write_capture(path):
+    writer = DTXCaptureWriter(path)
+    writer.write(DIRECTION_SEND, channel_request_wire(1, OPENGL_CHANNEL))
+    writer.write(DIRECTION_SEND, channel_request_wire(2, SYSMONTAP_CHANNEL))
+    sysmontap = sysmontap_message(20, channel_code=2 ** 32 - 2).to_bytes()
+    ratio = OPENGL_MESSAGES // SYSMONTAP_MESSAGES
+    for i in range(OPENGL_MESSAGES):
+        writer.write(DIRECTION_RECV, opengl_wire(i + 10))
+        if i % ratio == 0:
+            writer.write(DIRECTION_RECV, sysmontap)
+    writer.close()
+
+
+def run(path, **kwargs):
+    opengl = []
+    sysmontap = []
+
+    def on_opengl(res):
+        opengl.append(time.perf_counter())
+
+    def on_sysmontap(res):
+        time.sleep(SLOW_CALLBACK)
+        sysmontap.append(time.perf_counter())
+
+    rpc = get_replay_rpc(path, **kwargs)
+    rpc.register_channel_callback(OPENGL_CHANNEL, on_opengl)
+    rpc.register_channel_callback(SYSMONTAP_CHANNEL, on_sysmontap)
+    begin = time.perf_counter()
+    rpc.start()
+    rpc._recv_thread.join()
+    received = time.perf_counter() - begin
+    rpc.stop()
+    stats = rpc.dispatch_stats()
+    rpc.deinit()
+    return received, opengl[-1] - begin, sysmontap[-1] - begin, stats
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'dispatch.dtxcap')
+    write_capture(path)
+    cases = [
+        ('inline', {}),
+        ('pool block', dict(dispatch_workers=4, dispatch_queue_size=256, dispatch_policy=DISPATCH_BLOCK)),
+        ('pool block/16', dict(dispatch_workers=4, dispatch_queue_size=16, dispatch_policy=DISPATCH_BLOCK)),
+        ('pool drop_oldest', dict(dispatch_workers=4, dispatch_queue_size=16, dispatch_policy=DISPATCH_DROP_OLDEST)),
+        ('pool drop_newest', dict(dispatch_workers=4, dispatch_queue_size=16, dispatch_policy=DISPATCH_DROP_NEWEST)),
+    ]
+    for name, kwargs in cases:
+        received, opengl_done, sysmontap_done, stats = run(path, **kwargs)
+        print(f"{name:17s} receiver {received * 1000:7.1f} ms, last opengl callback {opengl_done * 1000:7.1f} ms, "
+              f"last sysmontap callback {sysmontap_done * 1000:7.1f} ms")
+        for code, item in stats.items():
+            print(f"{'':17s} channel {2 ** 32 - code}: processed {item['processed']:5d}, dropped {item['dropped']:4d}, "
+                  f"max depth {item['max_depth']:3d}, receiver blocked {item['blocked']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+DTX 头部编解码: struct.Struct 实现与 ctypes.Structure 实现的 ops/sec 对比
+用法: python benchmark/dtx_header.py
+"""
+import os
+import sys
+import time
+from ctypes import Structure, c_uint32, c_uint16
+
+sys.path.append(os.getcwd())
+from instrument.dtxlib import DTXMessageHeader
+
+
+class CtypesDTXMessageHeader(Structure):
+    """ 旧版 ctypes 实现, 仅用于对比 """
+    _fields_ = [
+        ('magic', c_uint32),
+        ('cb', c_uint32),
+        ('fragmentId', c_uint16),
+        ('fragmentCount', c_uint16),
+        ('length', c_uint32),
+        ('identifier', c_uint32),
+        ('conversationIndex', c_uint32),
+        ('channelCode', c_uint32),
+        ('expectsReply', c_uint32)
+    ]
+
+
+def ops(func, rounds=200000):
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return rounds / (time.perf_counter() - begin)
+
+
+def main():
+    raw = bytes(DTXMessageHeader())
+    stream = bytearray(raw * 8)
+    out = bytearray(32)
+    new = DTXMessageHeader.unpack_from(raw)
+    old = CtypesDTXMessageHeader.from_buffer_copy(raw)
+
+    # 接收路径上每个 header 大约会读取这些字段
+    def decode_new():
+        h = DTXMessageHeader.unpack_from(stream, 64)
+        return (h.fragmentId, h.fragmentCount, h.channelCode, h.identifier, h.length,
+                h.fragmentCount, h.fragmentId, h.length)
+
+    def decode_old():
+        h = CtypesDTXMessageHeader.from_buffer_copy(stream, 64)
+        return (h.fragmentId, h.fragmentCount, h.channelCode, h.identifier, h.length,
+                h.fragmentCount, h.fragmentId, h.length)
+
+    def build_new():
+        h = DTXMessageHeader()
+        h.identifier, h.channelCode, h.length = 7, 3, 1024
+        return bytes(h)
+
+    def build_old():
+        h = CtypesDTXMessageHeader()
+        h.magic, h.cb, h.fragmentCount = 0x1f3d5b79, 32, 1
+        h.identifier, h.channelCode, h.length = 7, 3, 1024
+        return bytes(h)
+
+    cases = [
+        ('decode + read', decode_new, decode_old),
+        ('construct + encode', build_new, build_old),
+        ('encode bytes()', lambda: bytes(new), lambda: bytes(old)),
+        ('encode pack_into', lambda: new.pack_into(out), lambda: out.__setitem__(slice(0, 32), bytes(old))),
+    ]
+    for name, func_new, func_old in cases:
+        n, o = ops(func_new), ops(func_old)
+        print(f"{name:20s} struct {n:12.0f} ops/s   ctypes {o:12.0f} ops/s   {n / o:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+DTXMessage.from_bytes 解析耗时与内存分配
+用法: python benchmark/dtx_parse.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import sysmontap_wire
+from instrument.dtxlib import DTXMessage
+
+
+def bench_parse(buf, rounds=200):
+    DTXMessage.from_bytes(buf)
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        DTXMessage.from_bytes(buf)
+    per_message = (time.perf_counter() - begin) / rounds
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    msg = DTXMessage.from_bytes(buf)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    del msg
+    return per_message, peak - base, blocks
+
+
+def main():
+    for process_count in (20, 400, 1200):
+        buf = sysmontap_wire(process_count)
+        per_message, peak, blocks = bench_parse(buf)
+        print(f"{process_count:5d} procs {len(buf):8d} bytes: {per_message * 1e6:9.1f} us/msg "
+              f"peak {peak / 1024:8.1f} KiB  retained blocks {blocks}")
+
+
+if __name__ == '__main__':
+    main()
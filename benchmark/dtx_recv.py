@@ -0,0 +1,50 @@
+"""
+DTX 接收吞吐: 预读缓冲与逐帧读取的对比, 同时输出每次系统调用得到的帧数
+用法: python benchmark/dtx_recv.py
+"""
+import os
+import socket
+import sys
+import time
+from threading import Thread
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import SocketClient, opengl_wire, sysmontap_wire
+from instrument.RPC import DTXUSBTransport, DTXClientMixin
+
+
+def run(stream, count, recv_buffer_size):
+    class T(DTXUSBTransport, DTXClientMixin):
+        pass
+
+    T.recv_buffer_size = recv_buffer_size
+    server, client = socket.socketpair()
+    sender = Thread(target=server.sendall, args=(stream,))
+    sender.start()
+    transport = T()
+    cli = SocketClient(client)
+    begin = time.perf_counter()
+    for _ in range(count):
+        transport.recv_dtx(cli)
+    cost = time.perf_counter() - begin
+    sender.join()
+    server.close()
+    client.close()
+    stats = transport.recv_stats(cli)
+    return count / cost, len(stream) / cost, transport.frames_received / stats['syscalls']
+
+
+def main():
+    cases = [
+        ('opengl 60fps x 20000', b''.join(opengl_wire(i) for i in range(20000)), 20000),
+        ('sysmontap 400 procs x 50', sysmontap_wire(400) * 50, 50),
+    ]
+    for name, stream, count in cases:
+        for size in (0, 256 * 1024):
+            msgs, rate, frames = run(stream, count, size)
+            print(f"{name:26s} buffer {size // 1024:4d} KiB: {msgs:10.0f} msg/s {rate / 2 ** 20:8.1f} MiB/s "
+                  f"{frames:6.2f} frames/syscall")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+消息路由: 旧版按 channel 编号换算查字典 + 每条消息解码 selector, 与路由表 DTXRouteTable 的单条消息路由耗时对比
+1.已注册 channel 的 sysmontap 消息
+2.server 发起的方法调用, 同一个 selector 反复出现
+3.没有注册任何回调的 channel 上的 sysmontap 消息, 最终交给 unhandled 回调
+用法: python benchmark/dtx_route.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import sysmontap_message
+from instrument.RPC import InstrumentRPC
+from instrument.dtxlib import DTXMessage, pyobject_to_auxiliary, pyobject_to_selector, selector_to_pyobject
+
+MESSAGES = 2000
+METHOD = "_notifyOfPublishedCapabilities:"
+
+
+def legacy_route(rpc, channel_callbacks, dtx):
+    """ 旧版 _handle_message 的路由部分, 仅用于对比 """
+    if 2 ** 32 - dtx.channel_code in channel_callbacks:
+        return channel_callbacks[2 ** 32 - dtx.channel_code], False
+    try:
+        selector = selector_to_pyobject(dtx.get_selector())
+    except:
+        selector = None
+    if selector and type(selector) is str and selector in rpc._callbacks:
+        return rpc._callbacks[selector], True
+    return rpc._unhanled_callback, False
+
+
+def method_wire(identifier) -> bytes:
+    dtx = DTXMessage()
+    dtx.identifier = identifier
+    dtx.set_selector(pyobject_to_selector(METHOD))
+    dtx.add_auxiliary(pyobject_to_auxiliary({'com.apple.instruments.server.services.sysmontap': 1}))
+    dtx.expects_reply = True
+    return dtx.to_bytes()
+
+
+def per_message(route, wires):
+    # 每条消息只路由一次, 与接收线程一致, 不会命中 DTXMessage 上已缓存的 selector
+    messages = [DTXMessage.from_bytes(wire) for wire in wires]
+    begin = time.perf_counter()
+    for dtx in messages:
+        route(dtx)
+    return (time.perf_counter() - begin) / len(messages) * 1e9
+
+
+def main():
+    rpc = InstrumentRPC()
+    callback = lambda res: None
+    rpc._routes.set_channel(2, callback)
+    rpc._callbacks[METHOD] = callback
+    rpc._unhanled_callback = callback
+    legacy_channels = {2: callback}
+
+    registered = sysmontap_message(400, channel_code=2 ** 32 - 2).to_bytes()
+    unhandled = sysmontap_message(400, channel_code=2 ** 32 - 3).to_bytes()
+    cases = [
+        ('registered channel', [registered] * MESSAGES),
+        ('method call', [method_wire(i) for i in range(MESSAGES)]),
+        ('unhandled channel', [unhandled] * 5),  # 旧版每条都要完整解码 400 个进程的采样
+    ]
+    for name, wires in cases:
+        assert rpc._route(DTXMessage.from_bytes(wires[0])) == legacy_route(rpc, legacy_channels,
+                                                                          DTXMessage.from_bytes(wires[0]))
+        new = per_message(rpc._route, wires)
+        old = per_message(lambda dtx: legacy_route(rpc, legacy_channels, dtx), wires)
+        print(f"{name:20s} route table {new:12.0f} ns/msg   legacy {old:12.0f} ns/msg   {old / new:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
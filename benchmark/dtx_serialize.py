@@ -0,0 +1,50 @@
+"""
+DTXMessage 序列化耗时: 小消息(含 selector 归档)与多 fragment 大消息
+用法: python benchmark/dtx_serialize.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import ns_keyed_archive, sysmontap_payload
+from instrument.dtxlib import DTXMessage, pyobject_to_selector, pyobject_to_auxiliary
+
+
+def per_op(func, rounds):
+    func()
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - begin) / rounds
+
+
+def small_call():
+    """ 与 InstrumentRPC._call 相同的构造过程 """
+    dtx = DTXMessage()
+    dtx.identifier = 5
+    dtx.channel_code = 3
+    dtx.set_selector(pyobject_to_selector("_requestChannelWithCode:identifier:"))
+    dtx.add_auxiliary(pyobject_to_auxiliary(3))
+    dtx.add_auxiliary(pyobject_to_auxiliary("com.apple.instruments.server.services.sysmontap"))
+    dtx.expects_reply = True
+    return dtx.to_bytes()
+
+
+def main():
+    print(f"small call (archive + serialize): {per_op(small_call, 2000) * 1e6:9.1f} us")
+
+    dtx = DTXMessage()
+    dtx.set_selector(pyobject_to_selector("start"))
+    dtx.add_auxiliary(pyobject_to_auxiliary(1))
+    print(f"small message serialize         : {per_op(dtx.to_bytes, 20000) * 1e6:9.1f} us")
+
+    for process_count in (400, 1200):
+        dtx = DTXMessage()
+        dtx.set_selector(ns_keyed_archive(sysmontap_payload(process_count)))
+        size = len(dtx.to_bytes())
+        print(f"fragmented {size:8d} bytes serialize: {per_op(dtx.to_bytes, 200) * 1e6:9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+默认解码与 strict 校验模式(序列化比对)的耗时对比, 使用多 fragment 的 sysmontap 消息
+用法: python benchmark/dtx_strict.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import sysmontap_wire, split_fragments
+from instrument.dtxlib import DTXMessage
+
+
+def bench(buf, strict, rounds=200):
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        DTXMessage.from_bytes(buf, strict)
+    return (time.perf_counter() - begin) / rounds
+
+
+def main():
+    buf = sysmontap_wire(400)
+    print(f"sysmontap message: {len(buf)} bytes, {len(split_fragments(buf))} fragments")
+    default = bench(buf, False)
+    strict = bench(buf, True)
+    print(f"default: {default * 1e6:9.1f} us/msg")
+    print(f"strict : {strict * 1e6:9.1f} us/msg  ({strict / default:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
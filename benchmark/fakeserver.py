@@ -0,0 +1,119 @@
+"""
+模拟 instrument 服务端, 供 benchmark 在没有设备的情况下驱动 InstrumentRPC / AsyncInstrumentRPC
+行为:
+1.连接建立后发送 _notifyOfPublishedCapabilities:
+2.应答 _requestChannelWithCode:identifier:
+3.其余需要回复的调用在 latency 秒之后回复, 回复内容为请求的 selector, lost_selectors 中的调用不回复
+4.drop_connections 断开所有已建立的连接, 模拟 usb 断开
+"""
+import asyncio
+import socket
+from threading import Thread
+
+from benchmark.fixtures import SocketClient
+from instrument.RPC import DTXFragment, DTXUSBTransport, InstrumentRPC
+from instrument.dtxlib import DTXMessage, DTXMessageHeader, pyobject_to_auxiliary, pyobject_to_selector, \
+    selector_to_pyobject
+
+
+class FakeDTXServer:
+
+    def __init__(self, latency=0.0, lost_selectors=()):
+        self.latency = latency
+        self.lost_selectors = set(lost_selectors)
+        self.calls = 0
+        self.loop = None
+        self._server = None
+        self._writers = set()
+
+    async def start(self, host='127.0.0.1', port=0) -> int:
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    def serve_in_thread(self) -> int:
+        """ 在单独的线程与事件循环中运行, 返回监听端口 """
+        loop = asyncio.new_event_loop()
+        port = loop.run_until_complete(self.start())
+        Thread(target=loop.run_forever, daemon=True).start()
+        return port
+
+    def close(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._server.close)
+
+    def drop_connections(self):
+        """ 断开所有连接, 监听端口保持可用 """
+        for writer in list(self._writers):
+            self.loop.call_soon_threadsafe(writer.transport.abort)
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        notify = DTXMessage()
+        notify.set_selector(pyobject_to_selector("_notifyOfPublishedCapabilities:"))
+        notify.add_auxiliary(pyobject_to_auxiliary({"com.apple.instruments.server.services.sysmontap": 1}))
+        writer.writelines(notify.to_buffers())
+        fragments = {}
+        try:
+            while 1:
+                header = DTXMessageHeader.unpack_from(await reader.readexactly(DTXMessageHeader.size))
+                key = (header.channelCode, header.identifier)
+                if header.fragmentId == 0:
+                    fragments[key] = DTXFragment(header)
+                    if header.fragmentCount > 1:
+                        continue
+                fragment = fragments[key]
+                fragment.slot(header)[:] = await reader.readexactly(header.length)
+                if fragment.completed:
+                    fragments.pop(key)
+                    self._on_message(fragment.message, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        self._writers.discard(writer)
+        writer.close()
+
+    def _on_message(self, dtx: DTXMessage, writer):
+        self.calls += 1
+        if not dtx.expects_reply:
+            return
+        if self.lost_selectors and selector_to_pyobject(dtx.get_selector()) in self.lost_selectors:
+            return
+        reply = dtx.new_reply()
+        reply.set_selector(dtx.get_selector() if dtx.channel_code != 0 else b'')
+        reply._payload_header.flags = 0x3
+        if self.latency:
+            self.loop.call_later(self.latency, self._reply, writer, reply)
+        else:
+            self._reply(writer, reply)
+
+    @staticmethod
+    def _reply(writer, reply: DTXMessage):
+        if not writer.is_closing():
+            writer.writelines(reply.to_buffers())
+
+
+def get_fake_rpc(port, host='127.0.0.1', **kwargs) -> InstrumentRPC:
+    """ 连接到 FakeDTXServer 的 InstrumentRPC, 重连时连接同一个端口 """
+
+    def start_service():
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return SocketClient(sock)
+
+    rpc = InstrumentRPC(**kwargs)
+    rpc._start_service = start_service
+    rpc._cli = start_service()
+    rpc._setup_transport(DTXUSBTransport)
+    return rpc
+
+
+async def get_fake_async_rpc(port, host='127.0.0.1'):
+    """ 连接到 FakeDTXServer 的 AsyncInstrumentRPC """
+    from instrument.aio import AsyncInstrumentRPC
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    rpc = AsyncInstrumentRPC()
+    rpc.init_stream(reader, writer)
+    return rpc
@@ -0,0 +1,202 @@
+"""
+benchmark 使用的 DTX 消息样本
+真实设备抓包数据不随仓库分发，这里按 sysmontap 的消息结构生成等价的 NSKeyedArchive 数据
+"""
+import plistlib
+import random
+import struct
+import time
+
+from instrument.capture import DTXCaptureWriter, DIRECTION_RECV, DIRECTION_SEND
+from instrument.dtxlib import DTXMessage, pyobject_to_selector, pyobject_to_auxiliary
+
+SYSMONTAP_PROC_ATTRS = ['memVirtualSize', 'cpuUsage', 'procStatus', 'appSleep', 'uid', 'vmPageIns', 'memRShrd',
+                        'ctxSwitch', 'memCompressed', 'intWakeups', 'cpuTotalSystem', 'responsiblePID',
+                        'physFootprint', 'cpuTotalUser', 'sysCallsUnix', 'memResidentSize', 'sysCallsMach',
+                        'memPurgeable', 'diskBytesRead', 'machPortCount', '__suddenTerm', '__arch', 'memRPrvt',
+                        'msgSent', 'ppid', 'threadCount', 'memAnon', 'diskBytesWritten', 'pgid', 'faults',
+                        'msgRecv', '__restricted', 'pid', '__sandbox']
+SYSMONTAP_SYS_ATTRS = ['diskWriteOps', 'diskBytesRead', 'diskBytesWritten', 'threadCount', 'vmCompressorPageCount',
+                       'vmExtPageCount', 'vmFreeCount', 'vmIntPageCount', 'vmPurgeableCount', 'netPacketsIn',
+                       'vmWireCount', 'netBytesIn', 'netPacketsOut', 'diskReadOps', 'vmUsedCount', '__vmSwapUsage',
+                       'netBytesOut']
+
+
+class SocketClient:
+    """ 与 PlistService 接口一致的最小 client, 用于本地 socket """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def recv(self, length=4096, timeout=-1):
+        try:
+            if timeout > 0:
+                self.sock.settimeout(timeout)
+            return self.sock.recv(length)
+        except OSError:
+            return b''
+
+    def recv_into(self, buffer, timeout=-1):
+        try:
+            if timeout > 0:
+                self.sock.settimeout(timeout)
+            return self.sock.recv_into(buffer)
+        except OSError:
+            return 0
+
+    def close(self):
+        self.sock.close()
+
+
+class _KeyedArchiver:
+    """ 用 plistlib 生成 NSKeyedArchive，保证样本与本仓库的 writer 无关 """
+
+    def __init__(self):
+        self.objects = ['$null']
+        self.classes = {}
+
+    def _class_uid(self, name):
+        if name not in self.classes:
+            self.classes[name] = plistlib.UID(len(self.objects))
+            self.objects.append({'$classname': name, '$classes': [name, 'NSObject']})
+        return self.classes[name]
+
+    def encode(self, obj):
+        if obj is None:
+            return plistlib.UID(0)
+        index = plistlib.UID(len(self.objects))
+        if isinstance(obj, dict) and '$class' in obj:
+            archive_obj = {}
+            self.objects.append(archive_obj)
+            for k, v in obj.items():
+                if k != '$class':
+                    archive_obj[k] = self.encode(v)
+            archive_obj['$class'] = self._class_uid(obj['$class'])
+        elif isinstance(obj, dict):
+            archive_obj = {}
+            self.objects.append(archive_obj)
+            archive_obj['NS.keys'] = [self.encode(k) for k in obj]
+            archive_obj['NS.objects'] = [self.encode(v) for v in obj.values()]
+            archive_obj['$class'] = self._class_uid('NSDictionary')
+        elif isinstance(obj, list):
+            archive_obj = {}
+            self.objects.append(archive_obj)
+            archive_obj['NS.objects'] = [self.encode(v) for v in obj]
+            archive_obj['$class'] = self._class_uid('NSArray')
+        else:
+            self.objects.append(obj)
+        return index
+
+    def to_bytes(self, obj):
+        root = self.encode(obj)
+        return plistlib.dumps({'$version': 100000, '$archiver': 'NSKeyedArchiver',
+                               '$top': {'root': root}, '$objects': self.objects},
+                              fmt=plistlib.FMT_BINARY, sort_keys=False)
+
+
+def ns_keyed_archive(obj) -> bytes:
+    return _KeyedArchiver().to_bytes(obj)
+
+
+def sysmontap_payload(process_count=400, seed=0):
+    """ 生成一条 sysmontap 采样数据（Processes + System），结构与 setConfig: 全量字段一致 """
+    rnd = random.Random(seed)
+    processes = {}
+    for i in range(process_count):
+        pid = 100 + i
+        row = [rnd.randint(0, 2 ** 40) for _ in SYSMONTAP_PROC_ATTRS]
+        row[1] = rnd.random() * 100
+        row[21] = 'arm64'
+        row[32] = pid
+        processes[pid] = row
+    system = [rnd.randint(0, 2 ** 32) for _ in SYSMONTAP_SYS_ATTRS]
+    return [
+        {'$class': 'DTSysmonTapMessage', 'DTTapMessagePlist': {
+            'Processes': processes, 'Type': 7, 'StartMachAbsTime': 5204500000, 'EndMachAbsTime': 5205500000}},
+        {'$class': 'DTSysmonTapMessage', 'DTTapMessagePlist': {
+            'System': system, 'Type': 41, 'StartMachAbsTime': 5204500000, 'EndMachAbsTime': 5205500000}},
+    ]
+
+
+def networking_payloads(count=200, seed=0):
+    """
+    生成 networking channel 的消息: interface-detection, connection-detected (sockaddr 为 NSData), connection-update
+    每条消息是一个 [类型, 数据] 数组
+    """
+    rnd = random.Random(seed)
+    payloads = [[0, [rnd.randint(1, 16), f'en{i}']] for i in range(4)]
+    for i in range(count):
+        serial = i // 4
+        if i % 4 == 0:
+            local = struct.pack('>BBH4s8x', 16, 2, rnd.randint(1024, 65535), bytes(rnd.randrange(256) for _ in range(4)))
+            remote = struct.pack('>BBH4s8x', 16, 2, 443, bytes(rnd.randrange(256) for _ in range(4)))
+            payloads.append([1, [local, remote, rnd.randint(1, 16), rnd.randint(100, 2000), 131072, 0, serial, 1]])
+        else:
+            payloads.append([2, [rnd.randint(0, 2 ** 20) for _ in range(9)] + [serial, rnd.random() * 1000]])
+    return payloads
+
+
+def sysmontap_message(process_count=400, seed=0, identifier=1, channel_code=2 ** 32 - 1) -> DTXMessage:
+    dtx = DTXMessage()
+    dtx.identifier = identifier
+    dtx.channel_code = channel_code
+    dtx.set_selector(ns_keyed_archive(sysmontap_payload(process_count, seed)))
+    return dtx
+
+
+def sysmontap_wire(process_count=400, seed=0, identifier=1) -> bytes:
+    """ 返回完整的 DTX 线上字节流，超过 65504 字节时会被切分为多个 fragment """
+    return sysmontap_message(process_count, seed, identifier).to_bytes()
+
+
+def split_fragments(buffer: bytes):
+    """ 把线上字节流按 DTXMessageHeader 切分为单个 fragment（header + body）"""
+    fragments = []
+    cursor = 0
+    while cursor < len(buffer):
+        fragment_id, fragment_count, length = struct.unpack_from('<HHI', buffer, cursor + 8)
+        end = cursor + 32
+        if not (fragment_count > 1 and fragment_id == 0):
+            end += length
+        fragments.append(buffer[cursor:end])
+        cursor = end
+    return fragments
+
+
+SYSMONTAP_CHANNEL = "com.apple.instruments.server.services.sysmontap"
+OPENGL_CHANNEL = "com.apple.instruments.server.services.graphics.opengl"
+
+
+def channel_request_wire(code, channel, identifier=None) -> bytes:
+    """ client 发出的 _requestChannelWithCode:identifier: 请求 """
+    request = DTXMessage()
+    request.identifier = code if identifier is None else identifier
+    request.set_selector(pyobject_to_selector("_requestChannelWithCode:identifier:"))
+    request.add_auxiliary(pyobject_to_auxiliary(code))
+    request.add_auxiliary(pyobject_to_auxiliary(channel))
+    request.expects_reply = True
+    return request.to_bytes()
+
+
+def opengl_wire(identifier, channel_code=2 ** 32 - 1) -> bytes:
+    """ opengl channel 的 fps 采样消息, 只有几百字节 """
+    dtx = DTXMessage()
+    dtx.identifier = identifier
+    dtx.channel_code = channel_code
+    dtx.set_selector(ns_keyed_archive({'CoreAnimationFramesPerSecond': 60, 'XRVideoCardRunTimeStamp': identifier}))
+    return dtx.to_bytes()
+
+
+def write_sysmontap_capture(path, messages=200, process_count=400, interval=1.0):
+    """
+    生成一个 sysmontap 抓包文件: 一次 channel 请求, 之后是 messages 条间隔 interval 秒的采样消息
+    """
+    writer = DTXCaptureWriter(path)
+    writer.write(DIRECTION_SEND, channel_request_wire(1, SYSMONTAP_CHANNEL))
+    begin = time.time()
+    for i in range(messages):
+        # 不同的消息使用少量不同的数据, 避免全部相同
+        wire = sysmontap_wire(process_count, seed=i % 4, identifier=i + 2)
+        for fragment in split_fragments(wire):
+            writer.write_at(begin + i * interval, DIRECTION_RECV, fragment)
+    writer.close()
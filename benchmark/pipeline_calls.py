@@ -0,0 +1,61 @@
+"""
+多 channel 启动耗时: 逐个阻塞调用, open_channels 之后再调用, 以及 call_many 流水线发送的对比
+每个 channel 需要 _requestChannelWithCode:identifier:, setConfig:, start 三次调用, 服务端模拟 RTT
+用法: python benchmark/pipeline_calls.py [RTT 毫秒]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fakeserver import FakeDTXServer, get_fake_rpc
+from instrument.RPC import pre_call
+
+CHANNELS = ["com.apple.instruments.server.services.sysmontap",
+            "com.apple.instruments.server.services.graphics.opengl",
+            "com.apple.instruments.server.services.networking",
+            "com.apple.xcode.debug-gauge-data-providers.Energy",
+            "com.apple.instruments.server.services.activitytracetap",
+            "com.apple.instruments.server.services.processcontrol"]
+
+
+def blocking(rpc):
+    for channel in CHANNELS:
+        rpc.call(channel, "setConfig:", {'ur': 1000})
+        rpc.call(channel, "start")
+
+
+def burst_open(rpc):
+    rpc.open_channels(CHANNELS)
+    for future in rpc.call_many([(channel, "setConfig:", {'ur': 1000}) for channel in CHANNELS]):
+        future.result()
+    for future in rpc.call_many([(channel, "start") for channel in CHANNELS]):
+        future.result()
+
+
+def pipelined(rpc):
+    futures = rpc.call_many([(channel, "setConfig:", {'ur': 1000}) for channel in CHANNELS] +
+                            [(channel, "start") for channel in CHANNELS])
+    for future in futures:
+        future.result()
+
+
+def main():
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.005
+    server = FakeDTXServer(latency=rtt)
+    port = server.serve_in_thread()
+    for name, startup in (('blocking', blocking), ('open+calls', burst_open), ('call_many', pipelined)):
+        rpc = get_fake_rpc(port)
+        pre_call(rpc)
+        begin = time.perf_counter()
+        startup(rpc)
+        cost = time.perf_counter() - begin
+        rpc.stop()
+        rpc.deinit()
+        print(f"{name:11s} {len(CHANNELS)} channels, {len(CHANNELS) * 3} calls: {cost * 1000:7.1f} ms "
+              f"({cost / rtt:5.1f} x RTT)")
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
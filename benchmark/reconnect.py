@@ -0,0 +1,66 @@
+"""
+断线重连: 服务端反复断开连接, 统计从检测到断线到 channel 重建, 调用重放完成的耗时
+每个 channel 注册回调并调用 setConfig:, start, 重连后检查每个 channel 都收到了 InstrumentRPCGap, 且之后的调用正常返回
+用法: python benchmark/reconnect.py [RTT 毫秒]
+"""
+import os
+import sys
+from threading import Condition
+
+sys.path.append(os.getcwd())
+from benchmark.fakeserver import FakeDTXServer, get_fake_rpc
+from benchmark.pipeline_calls import CHANNELS
+from instrument.RPC import InstrumentRPCGap, pre_call
+
+DROPS = 20
+RECONNECT_INTERVAL = 0.05
+
+
+def main():
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.005
+    server = FakeDTXServer(latency=rtt)
+    port = server.serve_in_thread()
+    rpc = get_fake_rpc(port, reconnect=5, reconnect_interval=RECONNECT_INTERVAL, call_timeout=10)
+    pre_call(rpc)
+    cond = Condition()
+    gaps = {channel: 0 for channel in CHANNELS}
+
+    def on_message(channel):
+        def callback(res):
+            if isinstance(res, InstrumentRPCGap):
+                with cond:
+                    gaps[channel] += 1
+                    cond.notify_all()
+        return callback
+
+    for channel in CHANNELS:
+        rpc.register_channel_callback(channel, on_message(channel))
+        rpc.call(channel, "setConfig:", {'ur': 1000})
+        rpc.call(channel, "start")
+
+    calls = server.calls
+    try:
+        for i in range(DROPS):
+            server.drop_connections()
+            with cond:
+                if not cond.wait_for(lambda: min(gaps.values()) > i, 10):
+                    print(f"drop {i}: gap marker missing: {gaps}")
+                    return
+            assert rpc.call(CHANNELS[0], "ping").parsed == "ping"
+    finally:
+        rpc.stop()
+        rpc.deinit()
+        server.close()
+
+    stats = rpc.reconnect_stats()
+    latency = stats['latency']
+    print(f"RTT {rtt * 1000:.1f} ms, {len(CHANNELS)} channels, reconnect interval {RECONNECT_INTERVAL * 1000:.0f} ms")
+    print(f"disconnects {stats['disconnects']}  reconnects {stats['reconnects']}  failures {stats['failures']}  "
+          f"replay errors {stats['replay_errors']}")
+    print(f"resume latency  mean {latency['mean'] * 1000:.1f} ms  max {latency['max'] * 1000:.1f} ms  "
+          f"p50 <= {latency['p50'] * 1000:.0f} ms  p99 <= {latency['p99'] * 1000:.0f} ms")
+    print(f"server saw {(server.calls - calls - DROPS) / DROPS:.0f} requests per reconnect (channels + journaled calls)")
+
+
+if __name__ == '__main__':
+    main()
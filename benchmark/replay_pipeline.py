@@ -0,0 +1,48 @@
+"""
+离线回放 sysmontap 抓包, 测量 接收 -> 解码 -> unarchive -> 回调 整条链路的吞吐
+用法: python benchmark/replay_pipeline.py [抓包文件]
+不指定抓包文件时生成一份 20 条 400 进程的 sysmontap 样本
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import SYSMONTAP_CHANNEL, write_sysmontap_capture
+from instrument.RPC import get_replay_rpc
+
+
+def replay(path, speed=None):
+    ctx = {'messages': 0, 'processes': 0}
+
+    def on_sysmontap_message(res):
+        for item in res.parsed:
+            ctx['processes'] += len(item.get('Processes', ()))
+        ctx['messages'] += 1
+
+    rpc = get_replay_rpc(path, speed)
+    rpc.register_channel_callback(SYSMONTAP_CHANNEL, on_sysmontap_message)
+    rpc.register_unhandled_callback(lambda res: None)
+    begin = time.perf_counter()
+    rpc.start()
+    rpc._recv_thread.join()
+    cost = time.perf_counter() - begin
+    rpc.stop()
+    rpc.deinit()
+    return ctx['messages'], ctx['processes'], cost
+
+
+def main():
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'sysmontap.dtxcap')
+        write_sysmontap_capture(path, messages=20)
+    messages, processes, cost = replay(path)
+    print(f"{path}: {messages} messages, {processes} process rows in {cost:.2f}s "
+          f"-> {messages / cost:.1f} msg/s, {os.path.getsize(path) / cost / 2 ** 20:.1f} MiB/s")
+
+
+if __name__ == '__main__':
+    main()
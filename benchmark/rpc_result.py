@@ -0,0 +1,61 @@
+"""
+InstrumentRPCResult 解码开销: 原先 plist 与 parsed 各解析一次 selector, 现在只在访问时解析一次
+输入为 sysmontap 抓包, 默认生成 10 条 400 进程的样本
+用法: python benchmark/rpc_result.py [抓包文件]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+from benchmark.fixtures import SYSMONTAP_CHANNEL, write_sysmontap_capture
+from instrument.RPC import InstrumentRPCResult, get_replay_rpc
+from instrument.bpylist import archiver
+from instrument.bpylist.bplistlib.readwrite import load
+
+
+def read_messages(path):
+    messages = []
+    rpc = get_replay_rpc(path)
+    rpc.register_channel_callback(SYSMONTAP_CHANNEL, lambda res: messages.append(res.raw))
+    rpc.start()
+    rpc._recv_thread.join()
+    rpc.stop()
+    rpc.deinit()
+    return messages
+
+
+def eager(dtx):
+    # 修改前 InstrumentRPCResult.__init__ 的行为
+    sel = dtx.get_selector()
+    load(sel)
+    return archiver.unarchive(sel)
+
+
+def lazy(dtx):
+    return InstrumentRPCResult(dtx).parsed
+
+
+def main():
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'sysmontap.dtxcap')
+        write_sysmontap_capture(path, messages=10)
+    messages = read_messages(path)
+    for name, decode in (('load + unarchive', eager), ('lazy parsed', lazy)):
+        begin = time.perf_counter()
+        for dtx in messages:
+            decode(dtx)
+        cost = time.perf_counter() - begin
+        print(f"{name:17s} {len(messages)} messages: {cost / len(messages) * 1000:8.1f} ms/msg")
+    begin = time.perf_counter()
+    for dtx in messages:
+        InstrumentRPCResult(dtx)
+    cost = time.perf_counter() - begin
+    print(f"{'construct only':17s} {len(messages)} messages: {cost / len(messages) * 1000:8.4f} ms/msg")
+
+
+if __name__ == '__main__':
+    main()
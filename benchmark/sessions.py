@@ -0,0 +1,90 @@
+"""
+多设备会话复用: 每个任务新建连接 (get_usb_rpc 的用法) 与 InstrumentSessionManager 复用连接的对比
+模拟 40 台设备, 每台设备执行若干个任务, 每个任务在 sysmontap channel 上调用 setConfig:, start
+输出总耗时, 任务速率, 建立的连接数与线程数
+用法: python benchmark/sessions.py [设备数] [每台设备的任务数]
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.getcwd())
+from benchmark.fakeserver import FakeDTXServer, get_fake_rpc
+from benchmark.fixtures import SYSMONTAP_CHANNEL
+from instrument.RPC import pre_call
+from instrument.aio import AsyncInstrumentRPC
+from instrument.session import InstrumentSessionManager
+
+RTT = 0.002
+
+
+class FakeSessionManager(InstrumentSessionManager):
+    """ 所有设备连接到同一个 FakeDTXServer """
+
+    def __init__(self, port, **kwargs):
+        super().__init__(**kwargs)
+        self.port = port
+
+    async def _connect(self, session):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        rpc = AsyncInstrumentRPC(session.udid)
+        rpc.init_stream(reader, writer)
+        return rpc
+
+
+def per_job_connections(port, devices, jobs):
+    def job(udid):
+        rpc = get_fake_rpc(port)
+        try:
+            pre_call(rpc)
+            rpc.call(SYSMONTAP_CHANNEL, "setConfig:", {'ur': 1000})
+            rpc.call(SYSMONTAP_CHANNEL, "start")
+        finally:
+            rpc.stop()
+            rpc.deinit()
+
+    threads = 0
+    with ThreadPoolExecutor(devices) as pool:
+        for _ in range(jobs):
+            list(pool.map(job, range(devices)))
+            threads = max(threads, threading.active_count())
+    return devices * jobs, threads
+
+
+def pooled_sessions(port, devices, jobs):
+    async def job(session):
+        await session.call(SYSMONTAP_CHANNEL, "setConfig:", {'ur': 1000})
+        await session.call(SYSMONTAP_CHANNEL, "start")
+
+    with FakeSessionManager(port) as manager:
+        futures = [manager.submit(udid, job) for _ in range(jobs) for udid in range(devices)]
+        for future in futures:
+            future.result()
+        threads = threading.active_count()
+        stats = manager.stats()
+    latency = [s['latency']['p99'] for s in stats.values()]
+    print(f"    pooled p99 call latency per device: max {max(latency) * 1000:.1f} ms")
+    return sum(s['opens'] for s in stats.values()), threads
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    server = FakeDTXServer(latency=RTT)
+    port = server.serve_in_thread()
+    for name, func in [('per-job connection', per_job_connections), ('session manager', pooled_sessions)]:
+        begin = time.perf_counter()
+        opens, threads = func(port, devices, jobs)
+        cost = time.perf_counter() - begin
+        print(f"{name:20s} {devices} devices x {jobs} jobs: {cost * 1000:8.1f} ms  "
+              f"{devices * jobs / cost:8.0f} jobs/s  {opens:4d} connections  {threads:3d} threads")
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+并发调用压力测试: 多个线程共用一个 InstrumentRPC 同时调用, 检查每个回复是否交给了发出请求的线程
+服务端为 benchmark/fakeserver.py, 回复内容为请求的 selector, 每个调用使用不同的 selector
+用法: python benchmark/stress_calls.py [线程数] [每个线程的调用数]
+"""
+import os
+import sys
+import time
+from threading import Thread
+
+sys.path.append(os.getcwd())
+from benchmark.fakeserver import FakeDTXServer, get_fake_rpc
+from instrument.RPC import pre_call
+
+CHANNELS = ["com.apple.instruments.server.services.deviceinfo",
+            "com.apple.instruments.server.services.processcontrol",
+            "com.apple.instruments.server.services.sysmontap",
+            "com.apple.instruments.server.services.networking"]
+
+
+def main():
+    # 缩短线程切换间隔, 放大竞争
+    sys.setswitchinterval(1e-6)
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    server = FakeDTXServer(latency=0.001)
+    port = server.serve_in_thread()
+    rpc = get_fake_rpc(port)
+    pre_call(rpc)
+    errors = []
+    failures = []
+    completed = []
+
+    def worker(tid):
+        for i in range(calls):
+            # 所有线程同时使用尚未建立的 channel, 同时覆盖 channel 请求的并发
+            channel = CHANNELS[(tid + i) % len(CHANNELS)]
+            selector = f"call:{tid}:{i}"
+            try:
+                if i % 2:
+                    ret = rpc.call_async(channel, selector).result(10).parsed
+                else:
+                    ret = rpc.call(channel, selector, timeout=10).parsed
+            except Exception as E:  # 超时, 连接断开等, 计入失败
+                failures.append((selector, repr(E)))
+                continue
+            completed.append(selector)
+            if ret != selector:
+                errors.append((selector, ret))
+
+    workers = [Thread(target=worker, args=(tid,)) for tid in range(threads)]
+    begin = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    cost = time.perf_counter() - begin
+    total = threads * calls
+    rpc.stop()
+    rpc.deinit()
+    server.close()
+    print(f"{threads} threads x {calls} calls: {total / cost:8.0f} calls/s, {len(errors)} misrouted, "
+          f"{len(failures)} failed, {len(rpc._channels)} channels, {server.calls} requests seen by server")
+    if errors:
+        print("first misrouted replies:", errors[:5])
+    if failures:
+        print("first failed calls:", failures[:5])
+    if errors or failures or len(completed) != total:
+        print(f"completed {len(completed)} of {total} calls")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
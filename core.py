@@ -77,14 +77,18 @@ def run_cli_options(args):
         return
 
     rpc = get_usb_rpc(args.udid)
-    attr_names = ["pid", "name", "realAppName"]
-    try: 
-        rpc.start()
-        processes = rpc.call("com.apple.instruments.server.services.deviceinfo", "runningProcesses").parsed
+    try:
+        pre_call(rpc)
+        profile(args, rpc)
     finally:
         rpc.stop()
         rpc.deinit()
 
+
+def profile(args, rpc):
+    attr_names = ["pid", "name", "realAppName"]
+    processes = rpc.call("com.apple.instruments.server.services.deviceinfo", "runningProcesses").parsed
+
     forground = filter(lambda x: x.get("foregroundRunning"), processes)
     application = filter(lambda x: not x.get("foregroundRunning") and x.get("isApplication"), processes)
 
@@ -169,22 +173,19 @@ def run_cli_options(args):
         if channel == "com.apple.instruments.server.services.graphics.opengl":
             ret = rpc.call(channel, "startSamplingAtTimeInterval:", 10)
     
-    rpc = get_usb_rpc()
-    try: 
-        pre_call(rpc)
-        
-        if "fps" in matrics:
-            make_channel("com.apple.instruments.server.services.graphics.opengl")
-            start_channel("com.apple.instruments.server.services.graphics.opengl")
-        if "cpu" in matrics or "mem" in matrics:
-            make_channel("com.apple.instruments.server.services.sysmontap")
-            start_channel("com.apple.instruments.server.services.sysmontap")
-        for i in range(timeout):
-            time.sleep(1)
-            print(profiler.CPU_USAGE, profiler.PSS_MEM, profiler.VIRTUAL_MEM, profiler.FPS)
-    finally:
-        rpc.stop()
-        rpc.deinit()
+    channels = []
+    if "fps" in matrics:
+        channels.append("com.apple.instruments.server.services.graphics.opengl")
+    if "cpu" in matrics or "mem" in matrics:
+        channels.append("com.apple.instruments.server.services.sysmontap")
+    for channel, latency in rpc.open_channels(channels).items():
+        log.debug("channel %s ready in %.1f ms", channel, latency * 1000)
+    for channel in channels:
+        make_channel(channel)
+        start_channel(channel)
+    for i in range(timeout):
+        time.sleep(1)
+        print(profiler.CPU_USAGE, profiler.PSS_MEM, profiler.VIRTUAL_MEM, profiler.FPS)
 
     
     return
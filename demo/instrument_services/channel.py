@@ -4,7 +4,6 @@ import sys
 sys.path.append(os.getcwd())
 from threading import Event
 from instrument.RPC import get_usb_rpc
-from instrument.dtxlib import auxiliary_to_pyobject
 from util import logging
 
 log = logging.getLogger(__name__)
@@ -16,7 +15,7 @@ def channels(rpc):
     def _notifyOfPublishedCapabilities(res):
         done.set()
         log.debug("Published capabilities:")
-        for k, v in auxiliary_to_pyobject(res.raw._auxiliaries[0]).items():
+        for k, v in res.raw.aux(0).items():
             log.debug(k, v)
 
     rpc.register_callback("_notifyOfPublishedCapabilities:", _notifyOfPublishedCapabilities)
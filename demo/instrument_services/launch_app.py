@@ -2,8 +2,6 @@ import os
 import sys
 from threading import Event
 
-from instrument.dtxlib import auxiliary_to_pyobject
-
 sys.path.append(os.getcwd())
 from instrument import RPC
 
@@ -11,9 +9,8 @@ from instrument import RPC
 def _launch_app(rpc, bundleid, callback):
 
     def on_channel_message(res):
-        if res.raw._auxiliaries:
-            for buf in res.raw._auxiliaries:
-                print(auxiliary_to_pyobject(buf))
+        for aux in res.raw.iter_aux():
+            print(aux)
 
     rpc.start()
     channel = "com.apple.instruments.server.services.processcontrol"
@@ -1,113 +1,525 @@
-import time
+import plistlib
 import time
 import traceback
-from ctypes import sizeof
-from threading import Thread, Event
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, InvalidStateError, TimeoutError as FutureTimeoutError, wait
+from threading import Event, Lock, RLock, Thread
 
 from instrument.bpylist import archiver
 from instrument.bpylist.bplistlib.readwrite import load
+from instrument.capture import DTXCaptureWriter, DTXReplayClient, DIRECTION_RECV, DIRECTION_SEND, read_channels
+from instrument.dispatch import DTXDispatcher, DISPATCH_BLOCK
 from instrument.dtxlib import DTXMessage, DTXMessageHeader, \
     pyobject_to_auxiliary, \
     pyobject_to_selector, selector_to_pyobject
+from instrument.metrics import LatencyHistogram
 from util import logging
-from util.exceptions import StartServiceError
+from util.exceptions import InstrumentRPCTimeoutError, StartServiceError
 from util.lockdown import LockdownClient
+from util.utils import cached_property, sendmsg_all
 
 log = logging.getLogger(__name__)
 
 
-def get_usb_rpc(udid=None):
-    rpc = InstrumentRPC(udid)
+def get_usb_rpc(udid=None, strict=False, **kwargs):
+    rpc = InstrumentRPC(udid, strict, **kwargs)
     if not rpc.init(DTXUSBTransport):
         return None
     return rpc
 
 
+def get_replay_rpc(path, speed=None, strict=False, **kwargs):
+    """
+    从抓包文件回放 instruments 数据流, 不需要连接设备
+    :param path: start_recording 生成的抓包文件
+    :param speed: None 表示以最快速度回放, 1.0 表示按原始速度回放
+    :param strict: 是否对每条消息做序列化比对校验
+    :param kwargs: 其余 InstrumentRPC 参数
+    :return: InstrumentRPC
+    """
+    rpc = InstrumentRPC(strict=strict, **kwargs)
+    rpc.init_replay(path, speed)
+    return rpc
+
+
 class DTXFragment:
+    """
+    DTX 消息重组, 第一个 fragment 到达时按 DTXMessageHeader.length 分配整块 payload,
+    之后每个 fragment 的 body 直接接收到它在 payload 中的最终位置
+    """
 
-    def __init__(self, buf):
-        self._header = DTXMessageHeader.from_buffer_copy(buf[:sizeof(DTXMessageHeader)])
-        self._bufs = [buf]
-        self.current_fragment_id = 0 if self._header.fragmentId == 0 else -1
+    def __init__(self, header: DTXMessageHeader, strict=False):
+        self._header = header
+        self._payload = bytearray(header.length)
+        self._view = memoryview(self._payload)
+        self._offset = 0
+        self._strict = strict
+        # 多 fragment 消息的第 0 个 fragment 只有 header, 单 fragment 消息的 body 紧跟在 header 之后
+        self.current_fragment_id = 0 if header.fragmentCount > 1 else -1
 
-    def append(self, buf):
-        assert self.current_fragment_id >= 0, "attempt to append to an broken fragment"
-        assert len(buf) >= sizeof(DTXMessageHeader)
-        subheader = DTXMessageHeader.from_buffer_copy(buf[:sizeof(DTXMessageHeader)])
+    def slot(self, subheader: DTXMessageHeader) -> memoryview:
+        """
+        校验 fragment header, 返回该 fragment body 在 payload 中的位置
+        :param subheader: 当前 fragment 的 DTXMessageHeader
+        :return: 长度为 subheader.length 的 memoryview
+        """
         assert subheader.fragmentCount == self._header.fragmentCount
         assert subheader.fragmentId == self.current_fragment_id + 1
+        if self._offset + subheader.length > len(self._payload):
+            raise ValueError("DTX fragment exceeds DTXMessageHeader->length")
+        view = self._view[self._offset: self._offset + subheader.length]
+        self._offset += subheader.length
         self.current_fragment_id = self.current_fragment_id + 1
-        self._bufs.append(buf)
+        return view
 
     @property
     def message(self):
         assert self.completed, "should only be called when completed"
-        return DTXMessage.from_bytes(b''.join(self._bufs))
+        return DTXMessage.from_payload(self._header, self._payload, self._strict)
 
     @property
     def completed(self):
         return self.current_fragment_id + 1 == self._header.fragmentCount
 
+    @property
+    def size(self):
+        return len(self._payload)
+
+    @property
+    def received(self):
+        return self._offset
+
+    @property
+    def fragment_count(self):
+        return self._header.fragmentCount
+
     @property
     def key(self):
         return self._header.channelCode, self._header.identifier
 
-    @property
-    def header(self):
-        return self._header.fragmentId == 0
+
+class DTXFragmentTable:
+    """
+    多 fragment 消息的重组表
+    按预分配的 payload 大小统计占用内存, 超过 max_bytes 时淘汰最早的条目, 超过 max_age 秒未完成的条目也会被淘汰,
+    避免丢失最后一个 fragment 的消息永久占用内存
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_age=60):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()  # key -> (创建时间, DTXFragment), 按创建顺序排列
+        self.bytes_buffered = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.max_fragment_count = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reserve(self, key, header: DTXMessageHeader) -> bool:
+        """
+        在按 header.length 分配 payload 之前调用: 淘汰超时的条目, 多 fragment 消息淘汰最早的条目直到放得下
+        :return: bool 是否可以分配, header.length 超过 max_bytes 时返回 False, 消息的 body 应直接丢弃
+        """
+        self._evict(time.monotonic())
+        self.max_fragment_count = max(self.max_fragment_count, header.fragmentCount)
+        if header.length > self.max_bytes:
+            self._count_eviction(key, 0, header.length)
+            return False
+        if header.fragmentCount > 1:
+            self.pop(key)
+            while self._entries and self.bytes_buffered + header.length > self.max_bytes:
+                old_key, (_, old_fragment) = self._entries.popitem(last=False)
+                self.bytes_buffered -= old_fragment.size
+                self._count_eviction(old_key, old_fragment.received, old_fragment.size)
+        return True
+
+    def add(self, key, fragment: DTXFragment):
+        """
+        加入一个新的重组条目, 需要先调用 reserve 腾出空间
+        """
+        self._entries[key] = (time.monotonic(), fragment)
+        self.bytes_buffered += fragment.size
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.bytes_buffered -= entry[1].size
+        return entry[1]
+
+    def _evict(self, now):
+        while self._entries:
+            key, (created, fragment) = next(iter(self._entries.items()))
+            if now - created <= self.max_age:
+                break
+            self.pop(key)
+            self._count_eviction(key, fragment.received, fragment.size)
+
+    def _count_eviction(self, key, received, size):
+        self.evictions += 1
+        self.evicted_bytes += size
+        log.warning('丢弃未完成的 DTX 消息: key %s, %d/%d bytes', key, received, size)
+
+    def stats(self) -> dict:
+        self._evict(time.monotonic())
+        return {
+            'in_flight': len(self._entries),
+            'bytes_buffered': self.bytes_buffered,
+            'bytes_received': sum(fragment.received for _, fragment in self._entries.values()),
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes,
+            'max_fragment_count': self.max_fragment_count,
+        }
+
+
+class DTXIdentifierAllocator:
+    """
+    DTX 消息 identifier 分配, 调用线程分配, 接收线程根据设备端发起的消息向前推进, identifier 为 uint32, 溢出后从 1 开始
+    """
+
+    def __init__(self, start=1):
+        self._next = start
+        self._lock = Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            identifier = self._next
+            self._next = identifier + 1 if identifier < 0xFFFFFFFF else 1
+            return identifier
+
+    def advance(self, identifier: int):
+        """ 之后分配的 identifier 大于 identifier, 避免与设备端发起的消息冲突 """
+        if identifier < self._next:
+            return
+        with self._lock:
+            if identifier >= self._next:
+                self._next = identifier + 1 if identifier < 0xFFFFFFFF else 1
+
+
+class DTXWaitTable:
+    """
+    等待回复的调用表, key 为 (channel_code, identifier), value 为 Future
+    连接断开后 close 会结束所有等待中的调用, 之后的登记会失败, 不会有调用永远等不到结果
+    """
+
+    def __init__(self):
+        self._waits = {}
+        self._lock = Lock()
+        self.closed = False
+
+    def __len__(self):
+        return len(self._waits)
+
+    def __contains__(self, key):
+        return key in self._waits
+
+    def add(self, key, request: Future):
+        with self._lock:
+            if self.closed:
+                raise RuntimeWarning("rpc service died")
+            if key in self._waits:
+                raise RuntimeError(f"duplicate DTX wait key: {key}")
+            self._waits[key] = request
+
+    def pop(self, key):
+        with self._lock:
+            return self._waits.pop(key, None)
+
+    def close(self, result):
+        with self._lock:
+            self.closed = True
+            waits, self._waits = self._waits, {}
+        for request in waits.values():
+            try:
+                request.set_result(result)
+            except InvalidStateError:
+                pass
+
+
+class DTXSessionJournal:
+    """
+    按 channel 记录调用 (setConfig:, start 等), 重连后在新连接上按顺序重放
+    同一 channel 上重复的 selector 只保留最后一次的参数
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def record(self, channel: str, selector: str, auxiliaries: tuple, expects_reply=True):
+        """
+        :param expects_reply: 是否需要回复, call_noret 的调用重放时同样不等待回复
+        """
+        with self._lock:
+            calls = self._calls.setdefault(channel, OrderedDict())
+            calls.pop(selector, None)
+            calls[selector] = (auxiliaries, expects_reply)
+
+    def calls(self, channel: str) -> list:
+        """
+        :return: [(selector, auxiliaries, expects_reply)], 按调用顺序
+        """
+        with self._lock:
+            return [(selector, auxiliaries, expects_reply)
+                    for selector, (auxiliaries, expects_reply) in self._calls.get(channel, {}).items()]
+
+
+class DTXRouteTable:
+    """
+    接收消息的路由表:
+    1.channel 回调按消息头中的 channel code 直接索引, 不需要换算 channel 编号
+    2.方法调用的 selector 按原始归档字节缓存解码结果, 同一个 selector 每次归档得到的字节相同, 命中时不需要解码 NSKeyedArchive
+    """
+    SELECTOR_MAX = 1024  # 超过这个长度的 selector 不会是方法名, 直接按数据消息处理
+    CACHE_SIZE = 512
+
+    def __init__(self):
+        self._channels = {}
+        self._selectors = {}
+
+    def set_channel(self, channel_id: int, callback):
+        self._channels[(2 ** 32 - channel_id) & 0xFFFFFFFF] = callback
+
+    def get_channel(self, channel_id: int):
+        return self._channels.get((2 ** 32 - channel_id) & 0xFFFFFFFF)
+
+    def pop_channel(self, channel_id: int):
+        return self._channels.pop((2 ** 32 - channel_id) & 0xFFFFFFFF, None)
+
+    def channel(self, channel_code: int):
+        """
+        :param channel_code: 消息头中的 channel code
+        :return: channel 回调, 没有时返回 None
+        """
+        return self._channels.get(channel_code)
+
+    def selector(self, dtx: DTXMessage):
+        """
+        :return: 方法名, selector 不是字符串时返回 None
+        """
+        sel = dtx.get_selector_view()
+        if not sel or len(sel) > self.SELECTOR_MAX:
+            return None
+        sel = dtx.get_selector()
+        name = self._selectors.get(sel, self)
+        if name is self:
+            try:
+                name = selector_to_pyobject(sel)
+            except:
+                name = None
+            if type(name) is not str:
+                name = None
+            if len(self._selectors) >= self.CACHE_SIZE:
+                self._selectors.clear()
+            self._selectors[sel] = name
+        return name
 
 
 class DTXClientMixin:
+    strict = False  # 为 True 时对每条接收的消息做序列化比对校验
+    fragment_memory_limit = 256 * 1024 * 1024  # 重组中的消息最多占用的内存
+    fragment_max_age = 60  # 重组中的消息最长等待时间, 秒
+    frames_received = 0
+    _recorder = None
+
+    def start_recording(self, path: str):
+        """
+        开始把收发的原始 DTX 数据写入抓包文件, 可以通过 DTXReplayTransport 离线回放
+        :param path: 抓包文件路径
+        """
+        self.stop_recording()
+        self._recorder = DTXCaptureWriter(path)
+
+    def stop_recording(self):
+        if self._recorder:
+            self._recorder.close()
+            self._recorder = None
 
     def send_dtx(self, client, dtx):
+        log.debug('发送 DTX: channel %d identifier %d', dtx.channel_code, dtx.identifier)
+        if hasattr(self, 'send_buffers'):
+            buffers = dtx.to_buffers()
+            if self._recorder:
+                self._recorder.write(DIRECTION_SEND, *buffers)
+            return self.send_buffers(client, buffers)
         buffer = dtx.to_bytes()
-        log.debug(f'发送 DTX: {buffer}')
+        if self._recorder:
+            self._recorder.write(DIRECTION_SEND, buffer)
         return self.send_all(client, buffer)
 
-    def recv_dtx_fragment(self, client, timeout=-1):
-        header_buffer = self.recv_all(client, sizeof(DTXMessageHeader), timeout=timeout)
-        if not header_buffer:
-            return None
-        header = DTXMessageHeader.from_buffer_copy(header_buffer)
-        if header.fragmentCount > 1 and header.fragmentId == 0:
-            return header_buffer
-        body_buffer = self.recv_all(client, header.length, timeout=timeout)
-        if not body_buffer:
+    def recv_dtx_header(self, client, timeout=-1):
+        header_buffer = bytearray(DTXMessageHeader.size)
+        if not self.recv_into(client, memoryview(header_buffer), timeout=timeout):
             return None
-        return header_buffer + body_buffer
+        return DTXMessageHeader.unpack_from(header_buffer)
 
     def recv_dtx(self, client, timeout=-1):
+        """
+        :return: DTXMessage, 在帧与帧之间超时或连接断开时返回 None
+        :raise DTXStreamDesync: 一帧只接收了一部分时超时或连接断开, 数据流已无法对齐
+        """
         self._setup_manager()
         while 1:
-            buf = self.recv_dtx_fragment(client, timeout)
-            if not buf:
+            header = self.recv_dtx_header(client, timeout)
+            if header is None:
                 return None
-            log.debug(f'接收 DTX: {buf}')
-            fragment = DTXFragment(buf)
-            if fragment.completed:
-                return fragment.message
+            self.frames_received += 1
             value = getattr(client, 'value', id(client))
-            key = (value, fragment.key)
-            if fragment.header:
-                self._dtx_demux_manager[key] = fragment
+            key = (value, (header.channelCode, header.identifier))
+            if header.fragmentId == 0:
+                if not self._dtx_demux_manager.reserve(key, header):
+                    # 超过内存上限的消息不分配 payload, 丢弃 body, 后续 fragment 找不到所属消息也会被丢弃
+                    if header.fragmentCount == 1 and not self.recv_discard(client, header, timeout=timeout):
+                        raise DTXStreamDesync(f"no body for DTX frame {key}")
+                    continue
+                fragment = DTXFragment(header, self.strict)
+                if header.fragmentCount > 1:
+                    if self._recorder:
+                        self._recorder.write(DIRECTION_RECV, bytes(header))
+                    self._dtx_demux_manager.add(key, fragment)
+                    continue
             else:
-                assert key in self._dtx_demux_manager
-                self._dtx_demux_manager[key].append(buf)
-                if self._dtx_demux_manager[key].completed:
-                    ret = self._dtx_demux_manager[key].message
-                    self._dtx_demux_manager.pop(key)
-                    return ret
+                fragment = self._dtx_demux_manager.get(key)
+                if fragment is None:
+                    # 所属消息已被淘汰, 丢弃 body 保持数据流对齐
+                    if not self.recv_discard(client, header, timeout=timeout):
+                        raise DTXStreamDesync(f"no body for DTX frame {key}")
+                    continue
+            try:
+                body = fragment.slot(header)
+            except (AssertionError, ValueError) as E:
+                # fragment 顺序或长度不符, 丢弃整条消息, body 照常读出保持数据流对齐
+                log.error('丢弃 fragment 异常的 DTX 消息: key %s: %r', key, E)
+                self._dtx_demux_manager.pop(key)
+                if not self.recv_discard(client, header, timeout=timeout):
+                    raise DTXStreamDesync(f"no body for DTX frame {key}")
+                continue
+            if not self.recv_into(client, body, timeout=timeout):
+                raise DTXStreamDesync(f"no body for DTX frame {key}")
+            if self._recorder:
+                self._recorder.write(DIRECTION_RECV, bytes(header), body)
+            if fragment.completed:
+                self._dtx_demux_manager.pop(key)
+                log.debug('接收 DTX: channel %d identifier %d length %d',
+                          header.channelCode, header.identifier, len(fragment._payload))
+                try:
+                    return fragment.message
+                except Exception as E:
+                    # 整条消息已经读出, 数据流仍然对齐, 跳过这条消息继续接收
+                    log.error('丢弃无法解析的 DTX 消息: channel %d identifier %d: %r',
+                              header.channelCode, header.identifier, E)
+
+    def recv_discard(self, client, header: DTXMessageHeader, timeout=-1) -> bool:
+        length = header.length
+        if self._recorder:
+            body = bytearray(length)
+            if not self.recv_into(client, memoryview(body), timeout=timeout):
+                return False
+            self._recorder.write(DIRECTION_RECV, bytes(header), body)
+            return True
+        scratch = memoryview(bytearray(min(length, 64 * 1024)))
+        while length > 0:
+            n = min(length, len(scratch))
+            if not self.recv_into(client, scratch[:n], timeout=timeout):
+                return False
+            length -= n
+        return True
+
+    def fragment_stats(self) -> dict:
+        self._setup_manager()
+        return self._dtx_demux_manager.stats()
 
     def _setup_manager(self):
         if hasattr(self, "_dtx_demux_manager"):
             return
-        self._dtx_demux_manager = {}
+        self._dtx_demux_manager = DTXFragmentTable(self.fragment_memory_limit, self.fragment_max_age)
+
+
+class DTXStreamDesync(ConnectionError):
+    """
+    一帧数据只接收了一部分时超时或连接断开, 已读出的数据无法放回数据流, 之后的数据不能再按帧解析
+    """
+
+
+class DTXRecvBuffer:
+    """
+    instruments socket 的预读缓冲
+    每次系统调用尽量读满缓冲区, 小的 DTX 帧直接从缓冲区取出, 一次 recv_into 可以得到多个完整帧;
+    缓冲区为空时, 不小于 direct_min 的 body 绕过缓冲区直接接收到目标位置, 只拷贝一次.
+    小于 direct_min 的 body 经过缓冲区, 多一次内存拷贝, 换取更少的系统调用
+    """
+
+    def __init__(self, size=256 * 1024, direct_min=16 * 1024):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.direct_min = min(direct_min, size)
+        self.syscalls = 0
+        self.bytes_read = 0
+        self.max_read = 0
+
+    def _recv(self, client, view, timeout):
+        received = client.recv_into(view, timeout)
+        self.syscalls += 1
+        if received:
+            self.bytes_read += received
+            self.max_read = max(self.max_read, received)
+        return received
+
+    def read_into(self, client, view: memoryview, timeout=-1) -> bool:
+        """
+        填满 view, 优先使用缓冲区中已有的数据
+        :return: bool 是否接收到完整数据, 没有读到任何数据时超时或连接断开返回 False
+        :raise DTXStreamDesync: 已经读出部分数据后超时或连接断开
+        """
+        length = len(view)
+        while view:
+            buffered = self._end - self._start
+            if buffered:
+                n = min(buffered, len(view))
+                view[:n] = self._view[self._start: self._start + n]
+                self._start += n
+                view = view[n:]
+            elif len(view) >= self.direct_min:
+                received = self._recv(client, view, timeout)
+                if not received:
+                    break
+                view = view[received:]
+            else:
+                self._start = 0
+                self._end = self._recv(client, self._view, timeout)
+                if not self._end:
+                    break
+        if not view:
+            return True
+        if len(view) < length:
+            raise DTXStreamDesync(f"received {length - len(view)} of {length} bytes")
+        return False
+
+    def stats(self) -> dict:
+        return {
+            'syscalls': self.syscalls,
+            'bytes_read': self.bytes_read,
+            'max_read': self.max_read,
+            'buffered': self._end - self._start,
+        }
 
 
 class DTXUSBTransport:
     """
     Instruments 服务，用于监控设备状态, 采集性能数据
     """
+    recv_buffer_size = 256 * 1024  # 为 0 时不使用预读缓冲
 
     def send_all(self, client, buffer: bytes) -> bool:
         """
@@ -117,7 +529,18 @@ class DTXUSBTransport:
         :param buffer: 数据
         :return: bool 是否成功
         """
-        client.sock.send(buffer)
+        client.sock.sendall(buffer)
+        return True
+
+    def send_buffers(self, client, buffers: list) -> bool:
+        """
+        使用 sendmsg 一次发送多个 buffer (header, auxiliaries, selector, fragments), 不拼接数据
+        成功时表示所有数据都被发出
+        :param client: instrument client(C对象）
+        :param buffers: 数据列表
+        :return: bool 是否成功
+        """
+        sendmsg_all(client.sock, buffers)
         return True
 
     def recv_all(self, client, length, timeout=-1) -> bytes:
@@ -129,16 +552,39 @@ class DTXUSBTransport:
         :param length: 数据长度
         :return: 长度为 length 的 buffer, 失败时返回 None
         """
-        ret = b''
-        while len(ret) < length:
-            L = length - len(ret)
-            if L > 8192:
-                L = 8192
-            rb = client.recv(L, timeout)
-            if not rb:
-                return ret
-            ret += rb
-        return ret
+        buffer = bytearray(length)
+        if not self.recv_into(client, memoryview(buffer), timeout):
+            return None
+        return bytes(buffer)
+
+    def recv_into(self, client, view: memoryview, timeout=-1) -> bool:
+        """
+        从 instrument client 接收数据直接写入 view, 不产生中间 bytes 对象
+        :param client: instrument client(C对象）
+        :param view: 目标 buffer, 需要被完整填满
+        :param timeout:
+        :return: bool 是否接收到完整数据
+        """
+        return self.recv_buffer(client).read_into(client, view, timeout)
+
+    def recv_buffer(self, client) -> DTXRecvBuffer:
+        if not hasattr(self, "_recv_buffers"):
+            self._recv_buffers = {}
+        value = getattr(client, 'value', id(client))
+        if value not in self._recv_buffers:
+            self._recv_buffers[value] = DTXRecvBuffer(self.recv_buffer_size)
+        return self._recv_buffers[value]
+
+    def recv_stats(self, client) -> dict:
+        """
+        接收统计: 系统调用次数, 读取字节数, 单次最大读取字节数, 缓冲区中尚未消费的字节数
+        """
+        return self.recv_buffer(client).stats()
+
+    def release_buffer(self, client):
+        """ 连接关闭后释放该 client 的预读缓冲 """
+        if hasattr(self, "_recv_buffers"):
+            self._recv_buffers.pop(getattr(client, 'value', id(client)), None)
 
     def pre_start(self, rpc):
         pass
@@ -147,6 +593,18 @@ class DTXUSBTransport:
         pass
 
 
+class DTXReplayTransport(DTXUSBTransport):
+    """
+    抓包回放, 接收的数据来自 DTXReplayClient, 发送的数据被丢弃
+    """
+
+    def send_all(self, client, buffer: bytes) -> bool:
+        return True
+
+    def send_buffers(self, client, buffers: list) -> bool:
+        return True
+
+
 class InstrumentRPCParseError:
     pass
 
@@ -160,44 +618,110 @@ class InstrumentRPCRawArg:
 
 
 class InstrumentRPCResult:
+    """
+    plist, parsed, xml 在第一次访问时才解码并缓存, parsed 复用 plist 的解码结果, selector 只会被解析一次
+    """
+
     def __init__(self, dtx):
         self.raw = dtx
+
+    @cached_property
+    def plist(self):
         if self.raw is None:
-            self.xml = None
-            self.parsed = None
-            self.plist = None
-            return
-        sel = dtx.get_selector()
+            return None
+        sel = self.raw.get_selector_view()  # 直接在接收 buffer 上解码, 不拷贝 selector
         if not sel:
-            self.xml = ""
-            self.plist = ""
-            self.parsed = None
-            return
+            return ""
         try:
-            self.plist = load(sel)
+            return load(sel)
         except:
-            self.plist = InstrumentRPCParseError()
+            return InstrumentRPCParseError()
+
+    @cached_property
+    def parsed(self):
+        plist = self.plist
+        if plist is None or plist == "":
+            return None
         try:
-            self.parsed = archiver.unarchive(sel)
+            return archiver.unarchive_plist(plist)
         except:
-            self.parsed = InstrumentRPCParseError()
+            return InstrumentRPCParseError()
+
+    @cached_property
+    def xml(self):
+        plist = self.plist
+        if plist is None or plist == "":
+            return plist
+        try:
+            return plistlib.dumps(plist).decode()
+        except:
+            return InstrumentRPCParseError()
+
+
+class InstrumentRPCGap(InstrumentRPCResult):
+    """
+    重连成功后在收到新数据之前交给每个 channel 回调的断线标记, raw / plist / parsed / xml 均为 None
+    lost_at ~ resumed_at 之间的数据已经丢失
+    """
+
+    def __init__(self, channel: str, lost_at: float, resumed_at: float):
+        super().__init__(None)
+        self.channel = channel
+        self.lost_at = lost_at
+        self.resumed_at = resumed_at
 
 
 class InstrumentRPC:
 
-    def __init__(self, udid=None):
+    def __init__(self, udid=None, strict=False, fragment_memory_limit=256 * 1024 * 1024, fragment_max_age=60,
+                 dispatch_workers=0, dispatch_queue_size=256, dispatch_policy=DISPATCH_BLOCK, call_timeout=None,
+                 reconnect=0, reconnect_interval=1.0):
+        """
+        :param udid: 设备 udid
+        :param strict: 调试模式, 接收到的每条 DTX 消息都会重新序列化并与原始数据比对
+        :param fragment_memory_limit: 重组中的多 fragment 消息最多占用的内存, 字节
+        :param fragment_max_age: 多 fragment 消息重组的最长等待时间, 秒, 超时的消息会被丢弃
+        :param dispatch_workers: 执行回调的线程数, 0 表示在接收线程中直接执行回调
+        :param dispatch_queue_size: 每个 channel 待处理消息队列的长度上限
+        :param dispatch_policy: 队列满时的处理方式, DISPATCH_BLOCK / DISPATCH_DROP_OLDEST / DISPATCH_DROP_NEWEST
+        :param call_timeout: call 的默认超时时间, 秒, None 表示一直等待
+        :param reconnect: 连接断开后的最大重连次数, 0 表示不重连. 重连成功后重建 channel, 重放已注册回调的 channel 上的调用,
+                          并向这些 channel 的回调发送 InstrumentRPCGap
+        :param reconnect_interval: 第一次重连前的等待时间, 秒, 之后每次翻倍, 最长 30 秒
+        """
         self._cli = None
         self._is = None
         self._recv_thread = None
         self._running = False
         self._callbacks = {}
-        self._sync_waits = {}
-        self._next_identifier = 1
+        self._sync_waits = DTXWaitTable()
+        self._identifiers = DTXIdentifierAllocator()
+        self._send_lock = Lock()
+        self._channel_lock = RLock()  # channel 请求的回复可能在登记回调时已经到达, 回调在持有锁的线程中执行
         self._channels = {}
+        self._channel_requests = {}
+        self._next_channel_id = 1
         self._receiver_exiting = False
         self._unhanled_callback = None
-        self._channel_callbacks = {}
+        self._routes = DTXRouteTable()
         self.udid = udid
+        self.strict = strict
+        self.fragment_memory_limit = fragment_memory_limit
+        self.fragment_max_age = fragment_max_age
+        self.dispatch_workers = dispatch_workers
+        self.dispatch_queue_size = dispatch_queue_size
+        self.dispatch_policy = dispatch_policy
+        self._dispatcher = None
+        self.call_timeout = call_timeout
+        self._latency = {}
+        self.reconnect = reconnect
+        self.reconnect_interval = reconnect_interval
+        self._transport = None
+        self._resume_thread = None
+        self._journal = DTXSessionJournal()
+        self._stopping = Event()
+        self._reconnect_latency = LatencyHistogram()
+        self._reconnect_counts = {'disconnects': 0, 'reconnects': 0, 'failures': 0, 'replay_errors': 0}
         self.lockdown = None
 
     def init(self, transport):
@@ -206,23 +730,58 @@ class InstrumentRPC:
         :return: bool 是否成功
         """
 
-        class T(transport, DTXClientMixin):
-            pass
+        self._cli = self._start_service()
+        self._setup_transport(transport)
+        if self._cli is None:
+            return False
+        return True
 
+    def _start_service(self):
         self.lockdown = self.lockdown if self.lockdown else LockdownClient(udid=self.udid)
         try:
-            self._cli = self.lockdown.start_service("com.apple.instruments.remoteserver")
-            if hasattr(self._cli.sock,'_sslobj'):
-                self._cli.sock._sslobj = None  # remoteserver 协议配对成功之后，需要关闭 ssl 协议通道，使用明文传输
+            cli = self.lockdown.start_service("com.apple.instruments.remoteserver")
+            if hasattr(cli.sock,'_sslobj'):
+                cli.sock._sslobj = None  # remoteserver 协议配对成功之后，需要关闭 ssl 协议通道，使用明文传输
         except StartServiceError as E:
             log.debug(E)
-            self._cli = self.lockdown.start_service("com.apple.instruments.remoteserver.DVTSecureSocketProxy")
+            cli = self.lockdown.start_service("com.apple.instruments.remoteserver.DVTSecureSocketProxy")
+        return cli
 
-        self._is = T()
-        if self._cli is None:
-            return False
+    def init_replay(self, path, speed=None):
+        """
+        初始化抓包回放, channel 编号从抓包中的 _requestChannelWithCode:identifier: 请求恢复,
+        注册 channel 回调时不会再发出请求
+        :param path: 抓包文件路径
+        :param speed: None 表示以最快速度回放
+        :return: bool 是否成功
+        """
+        self._cli = DTXReplayClient(path, speed)
+        self._channels.update(read_channels(path))
+        self._next_channel_id = max(self._channels.values(), default=0) + 1
+        self._setup_transport(DTXReplayTransport)
         return True
 
+    def _setup_transport(self, transport):
+        class T(transport, DTXClientMixin):
+            pass
+
+        self._transport = transport
+        self._is = T()
+        self._is.strict = self.strict
+        self._is.fragment_memory_limit = self.fragment_memory_limit
+        self._is.fragment_max_age = self.fragment_max_age
+
+    def start_recording(self, path):
+        """
+        把收发的原始 DTX 数据记录到抓包文件, 之后可以用 get_replay_rpc 离线回放
+        :param path: 抓包文件路径
+        :return: 无返回值
+        """
+        self._is.start_recording(path)
+
+    def stop_recording(self):
+        self._is.stop_recording()
+
     def deinit(self):
         """
         反初始化 instrument rpc 服务
@@ -232,6 +791,23 @@ class InstrumentRPC:
             self._cli.close()
             self._cli = None
 
+    def recv_stats(self) -> dict:
+        """
+        获取接收统计, 可以通过 frames / syscalls 判断每次系统调用读到的 DTX 消息数量
+        :return: dict
+        """
+        stats = {'frames': self._is.frames_received}
+        if hasattr(self._is, 'recv_stats'):
+            stats.update(self._is.recv_stats(self._cli))
+        return stats
+
+    def fragment_stats(self) -> dict:
+        """
+        获取分片重组表的统计: 重组中的消息数, 占用字节数, 已接收字节数, 淘汰次数与字节数, 出现过的最大 fragment 数
+        :return: dict
+        """
+        return self._is.fragment_stats()
+
     def start(self):
         """
         启动 instrument rpc 服务
@@ -240,6 +816,9 @@ class InstrumentRPC:
         if self._running:
             return True
         self._running = True
+        self._stopping.clear()
+        if self.dispatch_workers:
+            self._dispatcher = DTXDispatcher(self.dispatch_workers, self.dispatch_queue_size, self.dispatch_policy)
         self._recv_thread = Thread(target=self._receiver, name="InstrumentRecevier")
         self._is.pre_start(self)
         self._recv_thread.start()
@@ -252,11 +831,34 @@ class InstrumentRPC:
         :return: 无返回值
         """
         self._running = False
+        self._stopping.set()
         if self._recv_thread:
             self._recv_thread.join()
             self._recv_thread = None
+        if self._resume_thread:
+            self._resume_thread.join()
+            self._resume_thread = None
+        if self._dispatcher:
+            self._dispatcher.shutdown()
         pass
 
+    def dispatch_stats(self) -> dict:
+        """
+        获取回调分发的统计, 按 channel code 区分: 队列深度, 最大深度, 已处理, 丢弃数, 接收线程等待次数
+        :return: dict, 未启用线程池时为空
+        """
+        return self._dispatcher.stats() if self._dispatcher else {}
+
+    def reconnect_stats(self) -> dict:
+        """
+        获取重连统计: 断线次数, 重连成功次数, 失败的连接尝试次数, 重放失败的调用数,
+        以及从检测到断线到重放完成的耗时分布 latency, 单位秒
+        :return: dict
+        """
+        stats = dict(self._reconnect_counts)
+        stats['latency'] = self._reconnect_latency.to_dict()
+        return stats
+
     def register_callback(self, selector, callback):
         """
         注册回调, 接受 instrument server 到 client 的远程调用
@@ -274,7 +876,7 @@ class InstrumentRPC:
         :return: 无返回值
         """
         channel_id = self._make_channel(channel)
-        self._channel_callbacks[channel_id] = callback
+        self._routes.set_channel(channel_id, callback)
 
     def register_unhandled_callback(self, callback):
         """
@@ -284,43 +886,214 @@ class InstrumentRPC:
         """
         self._unhanled_callback = callback
 
-    def _make_channel(self, channel: str):
+    def _make_channel(self, channel: str, timeout=None):
+        """
+        :param timeout: 等待 channel 请求回复的超时时间, 秒
+        """
         if channel is None:
             return 0
-        if channel in self._channels:
-            return self._channels[channel]
+        channel_id, request = self._pending_channel(channel)
+        if request is not None:
+            self._check_channel_reply(self._wait_reply(request, timeout, shared=True))
+        return channel_id
+
+    def _pending_channel(self, channel: str):
+        """
+        channel 不存在时发出 channel 请求, 多个线程同时请求同一个 channel 时只会发出一次
+        :return: (channel 编号, 未完成的 channel 请求 Future), channel 已经建立时 Future 为 None
+        """
+        with self._channel_lock:
+            if channel not in self._channels:
+                request = self._request_channel(channel)
+                return request.channel_id, request
+            return self._channels[channel], self._channel_requests.get(channel)
+
+    def _request_channel(self, channel: str) -> Future:
+        # 超时取消的 channel 请求仍可能在设备端生效, channel code 不复用
+        channel_id = max(self._next_channel_id, len(self._channels) + 1)
+        self._next_channel_id = channel_id + 1
+        request = self._send_call(True, 0, "_requestChannelWithCode:identifier:", channel_id, channel)
+        request.channel_id = channel_id
+        self._channels[channel] = channel_id
+        self._channel_requests[channel] = request
+        request.add_done_callback(lambda f: self._on_channel_reply(channel, f))
+        return request
+
+    def open_channels(self, channels, timeout=None) -> dict:
+        """
+        一次发出所有 channel 请求, 再一起等待回复, 建立 N 个 channel 只需要约一次往返时间
+        :param channels: channel 名称列表
+        :param timeout: 等待回复的超时时间, 秒, 超时抛出 InstrumentRPCTimeoutError, 请求不会被取消, 回复到达后 channel 仍会建立
+        :return: {channel 名称: 从发出请求到收到回复的耗时, 秒}, 已经建立的 channel 耗时为 0
+        """
+        begin = time.monotonic()
+        latency = {}
+        pending = {}
+        for channel in channels:
+            _, request = self._pending_channel(channel)
+            if request is None:
+                latency[channel] = 0.0
+                continue
+            pending[channel] = request
+            request.add_done_callback(lambda f, c=channel: latency.__setitem__(c, time.monotonic() - begin))
+        _, not_done = wait(pending.values(), timeout)
+        if not_done:
+            for request in not_done:
+                self._latency_histogram(request.latency_key).timeouts += 1
+            raise InstrumentRPCTimeoutError(f"no reply for channel requests in {timeout}s: "
+                                            f"{[c for c, r in pending.items() if r in not_done]}")
+        failed = [channel for channel, request in pending.items()
+                  if request.cancelled() or request.result().get_selector()]
+        if failed:
+            raise RuntimeError(f"failed to make channel: {failed}")
+        return latency
+
+    def _on_channel_reply(self, channel, request: Future):
+        failed = request.cancelled() or request.result().get_selector()
+        with self._channel_lock:
+            self._channel_requests.pop(channel, None)
+            if failed:
+                self._channels.pop(channel, None)
+        if request.cancelled():
+            log.error("channel request cancelled: %s", channel)
+        elif failed:
+            log.error("make channel %s error: %s", channel, load(request.result().get_selector()))
 
-        channel_id = len(self._channels) + 1
-        dtx = self._call(True, 0, "_requestChannelWithCode:identifier:", channel_id, channel)
+    def _on_channel_failed(self, channel_request: Future, request: Future, ret: Future):
+        """
+        channel 请求失败时, 流水线发送在其后的调用不会再有回复, 结束等待并把错误交给调用方
+        """
+        if not (channel_request.cancelled() or channel_request.result().get_selector()):
+            return
+        self._cancel_request(request)
+        try:
+            ret.set_exception(RuntimeError("failed to make channel"))
+        except InvalidStateError:
+            pass
+
+    @staticmethod
+    def _check_channel_reply(dtx: DTXMessage):
         if dtx.get_selector():
-            print("Make Channel Error:", load(dtx.get_selector()))
             raise RuntimeError("failed to make channel")
-        self._channels[channel] = channel_id
-        return channel_id
 
-    def call(self, channel: str, selector: str, *auxiliaries):
-        channel_id = self._make_channel(channel)
-        ret = self._call(True, channel_id, selector, *auxiliaries)
+    def call(self, channel: str, selector: str, *auxiliaries, timeout=None):
+        """
+        :param timeout: 超时时间, 秒, 包括建立 channel 的时间, 默认使用 call_timeout, 超时抛出 InstrumentRPCTimeoutError
+        """
+        timeout = self.call_timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        channel_id = self._make_channel(channel, timeout=timeout)
+        self._record_call(channel, selector, auxiliaries)
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0)
+        ret = self._call(True, channel_id, selector, *auxiliaries, timeout=timeout)
         log.debug("plist" + str(ret))
         return InstrumentRPCResult(ret)
 
     def call_noret(self, channel: str, selector: str, *auxiliaries):
-        channel_id = self._make_channel(channel)
+        channel_id = self._make_channel(channel, timeout=self.call_timeout)
+        self._record_call(channel, selector, auxiliaries, expects_reply=False)
         self._call(False, channel_id, selector, *auxiliaries)
 
-    def _call(self, sync: bool, channel_id: int, selector: str, *auxiliaries):
+    def call_async(self, channel: str, selector: str, *auxiliaries) -> Future:
+        """
+        发送调用后立即返回, 不等待回复, channel 不存在时 channel 请求也同样流水线发送
+        调用 Future.cancel() 会放弃等待回复, 之后收到的回复交给 unhandled 回调
+        :return: concurrent.futures.Future, 结果为 InstrumentRPCResult
+        """
+        channel_id, channel_request = self._pending_channel(channel) if channel is not None else (0, None)
+        self._record_call(channel, selector, auxiliaries)
+        request = self._send_call(True, channel_id, selector, *auxiliaries)
+        ret = Future()
+
+        def on_reply(f):
+            if f.cancelled() or ret.done():
+                return
+            try:
+                ret.set_result(InstrumentRPCResult(f.result()))
+            except InvalidStateError:
+                pass
+
+        request.add_done_callback(on_reply)
+        ret.add_done_callback(lambda f: f.cancelled() and self._cancel_request(request))
+        if channel_request is not None:
+            channel_request.add_done_callback(lambda f: self._on_channel_failed(f, request, ret))
+        return ret
+
+    def call_many(self, calls) -> list:
+        """
+        一次发出多个调用再等待回复, N 个调用只需要约一次往返时间:
+            futures = rpc.call_many([(channel, "setConfig:", config), (channel, "start")])
+            results = [f.result() for f in futures]
+        :param calls: 可迭代对象, 每一项为 (channel, selector, *auxiliaries)
+        :return: list of concurrent.futures.Future
+        """
+        return [self.call_async(*call) for call in calls]
+
+    def _record_call(self, channel: str, selector: str, auxiliaries: tuple, expects_reply=True):
+        if self.reconnect and channel is not None:
+            self._journal.record(channel, selector, auxiliaries, expects_reply)
+
+    def _call(self, sync: bool, channel_id: int, selector: str, *auxiliaries, timeout=None):
         """
         :param sync: 是否回调
         :param channel_id: 通道标识
         :param selector: 请求方法名称，method name
         :param auxiliaries:
+        :param timeout: 等待回复的超时时间, 秒, None 表示一直等待
         :return:
         """
+        request = self._send_call(sync, channel_id, selector, *auxiliaries)
+        if sync:
+            return self._wait_reply(request, timeout)
+
+    def _wait_reply(self, request: Future, timeout=None, shared=False) -> DTXMessage:
+        """
+        :param shared: request 是多个调用方共享的 channel 请求, 超时只结束当前调用方的等待, 不取消请求
+        """
+        try:
+            return request.result(timeout)
+        except FutureTimeoutError:
+            if shared:
+                self._latency_histogram(request.latency_key).timeouts += 1
+            else:
+                self._timeout_request(request)
+            raise InstrumentRPCTimeoutError(f"no reply for {request.latency_key[1]} in {timeout:.3g}s")
+        except CancelledError:
+            raise InstrumentRPCTimeoutError(f"request for {request.latency_key[1]} was cancelled")
+
+    def _timeout_request(self, request: Future):
+        self._latency_histogram(request.latency_key).timeouts += 1
+        self._cancel_request(request)
+
+    def _cancel_request(self, request: Future):
+        self._sync_waits.pop(request.wait_key)
+        request.cancel()
+
+    def _latency_histogram(self, key) -> LatencyHistogram:
+        histogram = self._latency.get(key)
+        if histogram is None:
+            histogram = self._latency.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def latency_stats(self) -> dict:
+        """
+        获取调用耗时统计, 从发出请求到接收线程收到回复
+        :return: {(channel 名称, selector): {count, timeouts, mean, max, p50, p90, p99, buckets}}, 单位秒,
+                 channel 0 上的调用 channel 名称为 None
+        """
+        names = {channel_id: name for name, channel_id in list(self._channels.items())}
+        return {(names.get(channel_id), selector): histogram.to_dict()
+                for (channel_id, selector), histogram in list(self._latency.items())}
+
+    def _send_call(self, sync: bool, channel_id: int, selector: str, *auxiliaries):
+        """
+        发送调用, sync 为 True 时返回以 (channel_code, identifier) 登记在 _sync_waits 中的 Future, 结果为回复的 DTXMessage
+        """
         if self._receiver_exiting:
             raise RuntimeWarning("rpc service died")
         dtx = DTXMessage()
-        dtx.identifier = self._next_identifier
-        self._next_identifier += 1
+        dtx.identifier = self._identifiers.next()
         dtx.channel_code = channel_id
         dtx.set_selector(pyobject_to_selector(selector))
         wait_key = (dtx.channel_code, dtx.identifier)
@@ -329,64 +1102,195 @@ class InstrumentRPC:
                 dtx.add_auxiliary(aux.data)
             else:
                 dtx.add_auxiliary(pyobject_to_auxiliary(aux))
+        request = None
         if sync:
             dtx.expects_reply = True
-            param = {"result": None, "event": Event()}
-            self._sync_waits[wait_key] = param
-        self._is.send_dtx(self._cli, dtx)
-        if sync:
-            param['event'].wait()
-            ret = param['result']
-            self._sync_waits.pop(wait_key)
-            return ret
+            request = Future()
+            request.wait_key = wait_key
+            request.latency_key = (channel_id, selector)
+            request.sent = time.perf_counter()
+            self._sync_waits.add(wait_key, request)
+        self._send_dtx(dtx)
+        return request
+
+    def _send_dtx(self, dtx: DTXMessage):
+        # 一条消息可能需要多次系统调用才能发完, 多个线程同时发送时需要保证消息之间不交错
+        with self._send_lock:
+            return self._is.send_dtx(self._cli, dtx)
+
+    def _route(self, dtx: DTXMessage):
+        """
+        :return: (回调, 是否为方法调用), 没有对应的回调时返回 unhandled 回调
+        """
+        callback = self._routes.channel(dtx.channel_code)
+        if callback:
+            return callback, False
+        if self._callbacks:
+            callback = self._callbacks.get(self._routes.selector(dtx))
+            if callback:
+                return callback, True
+        return self._unhanled_callback, False
+
+    def _handle_message(self, dtx: DTXMessage):
+        callback, is_method = self._route(dtx)
+        if callback is None:
+            return
+        if is_method:
+            try:
+                ret = callback(InstrumentRPCResult(dtx))
+                if dtx.expects_reply:
+                    reply = dtx.new_reply()
+                    reply.set_selector(pyobject_to_selector(ret))
+                    reply._payload_header.flags = 0x3
+                    self._send_dtx(reply)
+            except:
+                traceback.print_exc()
+        else:
+            try:
+                callback(InstrumentRPCResult(dtx))
+            except:
+                traceback.print_exc()
 
     def _receiver(self):
+        try:
+            while self._running:
+                try:
+                    self._receive()
+                except Exception:
+                    # 接收过程中的异常之后连接状态未知, 与连接断开一样进入重连
+                    traceback.print_exc()
+                if not (self._running and self.reconnect and self._resume_session()):
+                    break
+        except Exception:
+            traceback.print_exc()
+        finally:
+            # 接收线程因任何原因退出都要唤醒所有等待中的调用
+            self._receiver_exiting = True  # to block incoming calls
+            self._sync_waits.close(InstrumentServiceConnectionLost)
+
+    def _receive(self):
+        """
+        接收消息直到连接断开或服务停止
+        """
         last_none = 0
         while self._running:
-            dtx = self._is.recv_dtx(self._cli, 2)  # s
+            try:
+                dtx = self._is.recv_dtx(self._cli, 2)  # s
+            except DTXStreamDesync as E:
+                # 帧中途超时, 之后的数据无法对齐, 与连接断开一样处理
+                log.error("instrument stream desynchronized: %s", E)
+                return
             if dtx is None:  # 长时间没有回调则抛出错误
                 cur = time.time()
                 if cur - last_none < 0.1:
-                    break
+                    return
                 last_none = cur
                 continue
-            self._next_identifier = max(self._next_identifier, dtx.identifier + 1)
-            wait_key = (dtx.channel_code, dtx.identifier)
-            if wait_key in self._sync_waits:
-                param = self._sync_waits[wait_key]
-                param['result'] = dtx
-                param['event'].set()
-            elif 2 ** 32 - dtx.channel_code in self._channel_callbacks:
+            self._identifiers.advance(dtx.identifier)
+            request = self._sync_waits.pop((dtx.channel_code, dtx.identifier))
+            if request:
+                self._latency_histogram(request.latency_key).record(time.perf_counter() - request.sent)
                 try:
-                    self._channel_callbacks[2 ** 32 - dtx.channel_code](InstrumentRPCResult(dtx))
-                except:
-                    traceback.print_exc()
+                    request.set_result(dtx)
+                except InvalidStateError:
+                    pass
+            elif self._dispatcher:
+                self._dispatcher.submit(dtx.channel_code, self._handle_message, dtx)
             else:
-                try:
-                    selector = selector_to_pyobject(dtx.get_selector())
-                except:
-                    selector = None
-
-                if selector and type(selector) is str and selector in self._callbacks:
-                    try:
-                        ret = self._callbacks[selector](InstrumentRPCResult(dtx))
-                        if dtx.expects_reply:
-                            reply = dtx.new_reply()
-                            reply.set_selector(pyobject_to_selector(ret))
-                            reply._payload_header.flags = 0x3
-                            self._is.send_dtx(self._cli, reply)
-                    except:
-                        traceback.print_exc()
+                self._handle_message(dtx)
+
+    def _resume_session(self) -> bool:
+        """
+        在接收线程中重连, 成功后由 InstrumentResume 线程重建 channel 并重放调用, 接收线程继续接收回复
+        :return: bool 是否重连成功
+        """
+        lost_at = time.time()
+        begin = time.perf_counter()
+        self._reconnect_counts['disconnects'] += 1
+        log.warning("instrument connection lost, reconnecting")
+        self._receiver_exiting = True
+        self._sync_waits.close(InstrumentServiceConnectionLost)
+        if self._resume_thread:
+            # 上一次重放的等待已被 close 结束, 新的调用会被拒绝, 等它退出后再开始新的重放, 避免调用被重放两次
+            self._resume_thread.join()
+            self._resume_thread = None
+        if not self._reconnect():
+            log.error("instrument reconnect failed after %d attempts", self.reconnect)
+            return False
+        self._sync_waits = DTXWaitTable()
+        self._identifiers = DTXIdentifierAllocator()
+        self._receiver_exiting = False
+        self._resume_thread = Thread(target=self._replay_session, args=(lost_at, begin), name="InstrumentResume")
+        self._resume_thread.start()
+        return True
+
+    def _reconnect(self) -> bool:
+        old, interval = self._cli, self.reconnect_interval
+        self._is.release_buffer(old)
+        try:
+            old.close()
+        except Exception:
+            pass
+        for attempt in range(self.reconnect):
+            if self._stopping.wait(min(interval * 2 ** attempt, 30)):
+                return False
+            try:
+                cli = self._start_service()
+            except Exception as E:
+                log.debug(E)
+                cli = None
+                self.lockdown = None  # usb 断开后 lockdown 连接也已失效
+            if cli is not None:
+                self._cli = cli
+                return True
+            self._reconnect_counts['failures'] += 1
+        return False
+
+    def _replay_session(self, lost_at: float, begin: float):
+        """
+        以原有的 channel 编号重新请求 channel, 向已注册回调的 channel 发送断线标记, 再重放这些 channel 上记录的调用
+        """
+        timeout = self.call_timeout or 30
+        with self._channel_lock:
+            channels = dict(self._channels)
+        try:
+            requests = {channel: self._send_call(True, 0, "_requestChannelWithCode:identifier:", channel_id, channel)
+                        for channel, channel_id in channels.items()}
+            wait(requests.values(), timeout)
+            for channel, request in requests.items():
+                if not request.done() or request.result().get_selector():
+                    self._cancel_request(request)
+                    self._reconnect_counts['replay_errors'] += 1
+                    log.error("failed to reopen channel %s", channel)
+                    channels.pop(channel)
+            resumed_at = time.time()
+            calls = []
+            for channel, channel_id in channels.items():
+                callback = self._routes.get_channel(channel_id)
+                if callback is None:
+                    continue
+                gap = InstrumentRPCGap(channel, lost_at, resumed_at)
+                if self._dispatcher:
+                    self._dispatcher.submit((2 ** 32 - channel_id) & 0xFFFFFFFF, callback, gap)
                 else:
-                    if self._unhanled_callback:
-                        try:
-                            self._unhanled_callback(InstrumentRPCResult(dtx))
-                        except:
-                            traceback.print_exc()
-        self._receiver_exiting = True  # to block incoming calls
-        for wait_key in self._sync_waits:
-            self._sync_waits[wait_key]['result'] = InstrumentServiceConnectionLost
-            self._sync_waits[wait_key]['event'].set()
+                    callback(gap)
+                for selector, auxiliaries, expects_reply in self._journal.calls(channel):
+                    request = self._send_call(expects_reply, channel_id, selector, *auxiliaries)
+                    if expects_reply:
+                        calls.append((selector, request))
+            wait([request for _, request in calls], timeout)
+            for selector, request in calls:
+                if not request.done():
+                    self._cancel_request(request)
+                    self._reconnect_counts['replay_errors'] += 1
+                    log.error("no reply for replayed call %s", selector)
+        except Exception:
+            self._reconnect_counts['replay_errors'] += 1
+            traceback.print_exc()
+            return
+        self._reconnect_counts['reconnects'] += 1
+        self._reconnect_latency.record(time.perf_counter() - begin)
+        log.info("instrument session resumed in %.3fs", time.perf_counter() - begin)
 
 
 def pre_call(rpc):
@@ -409,6 +1313,13 @@ if __name__ == '__main__':
 
     buf=bytes.fromhex('795b3d1f2000000000000100080400008d000000000000001f000000010000000200000053030000f803000000000000f00100000000000043030000000000000a000000020000003a02000062706c6973743030d40102030405062d2e582476657273696f6e58246f626a65637473592461726368697665725424746f7012000186a0af101007081a1b1c1d1e1f202122232425262755246e756c6cd2090a0b195a4e532e6f626a656374735624636c617373ad0c0d0e0f10111213141516171880028003800480058006800780088009800a800b800c800d800e800f5f10126e65742e72782e62797465732e64656c74615f10146e65742e74782e7061636b6574732e64656c74615c6e65742e74782e62797465735f10146e65742e72782e7061636b6574732e64656c74615b6e65742e7061636b6574735f10126e65742e74782e62797465732e64656c74615e6e65742e74782e7061636b6574735c6e65742e72782e62797465735f100f6e65742e62797465732e64656c74615f10116e65742e7061636b6574732e64656c74615e6e65742e72782e7061636b6574735f10116e65742e636f6e6e656374696f6e735b5d596e65742e6279746573d228292a2b5a24636c6173736e616d655824636c6173736573554e53536574a22a2c584e534f626a6563745f100f4e534b657965644172636869766572d12f3054726f6f74800100080011001a0023002d00320037004a0050005500600067007500770079007b007d007f00810083008500870089008b008d008f009100a600bd00ca00e100ed01020111011e0130014401530167017101760181018a01900193019c01ae01b101b600000000000002010000000000000031000000000000000000000000000001b80a00000002000000f100000062706c6973743030d4010203040515161758246f626a65637473582476657273696f6e592461726368697665725424746f70a406070d0e55246e756c6cd208090a0b5624636c6173735a4e532e6f626a656374738003a10c800211a052d20f1011125a24636c6173736e616d655824636c61737365735c4e534d757461626c65536574a3111314554e53536574584e534f626a65637412000186a05f100f4e534b657965644172636869766572d1181954726f6f74800108111a232d32373d42495456585a5d626d7683878d969badb0b50000000000000101000000000000001a000000000000000000000000000000b762706c6973743030d4010203040506070a582476657273696f6e592461726368697665725424746f7058246f626a6563747312000186a05f100f4e534b657965644172636869766572d1080954726f6f748001a20b0c55246e756c6c5f101973616d706c65417474726962757465733a666f72504944733a08111a24293237494c5153565c0000000000000101000000000000000d00000000000000000000000000000078795b3d1f2000000000000100620300008c00000000000000200000000100000002000000ad0200005203000000000000f0010000000000009d020000000000000a000000020000009401000062706c6973743030d40102030405062122582476657273696f6e58246f626a65637473592461726368697665725424746f7012000186a0aa07081415161718191a1b55246e756c6cd2090a0b135a4e532e6f626a656374735624636c617373a70c0d0e0f101112800280038004800580068007800880095b656e657267792e636f73745a656e657267792e4350555f1011656e657267792e6e6574776f726b696e675f100f656e657267792e6c6f636174696f6e5a656e657267792e4750555f100f656e657267792e61707073746174655f100f656e657267792e6f76657268656164d21c1d1e1f5a24636c6173736e616d655824636c6173736573554e53536574a21e20584e534f626a6563745f100f4e534b657965644172636869766572d1232454726f6f74800100080011001a0023002d0032003700420048004d0058005f00670069006b006d006f00710073007500770083008e00a200b400bf00d100e300e800f300fc01020105010e012001230128000000000000020100000000000000250000000000000000000000000000012a0a00000002000000f100000062706c6973743030d4010203040515161758246f626a65637473582476657273696f6e592461726368697665725424746f70a406070d0e55246e756c6cd208090a0b5624636c6173735a4e532e6f626a656374738003a10c800211a052d20f1011125a24636c6173736e616d655824636c61737365735c4e534d757461626c65536574a3111314554e53536574584e534f626a65637412000186a05f100f4e534b657965644172636869766572d1181954726f6f74800108111a232d32373d42495456585a5d626d7683878d969badb0b50000000000000101000000000000001a000000000000000000000000000000b762706c6973743030d4010203040506070a582476657273696f6e592461726368697665725424746f7058246f626a6563747312000186a05f100f4e534b657965644172636869766572d1080954726f6f748001a20b0c55246e756c6c5f101973616d706c65417474726962757465733a666f72504944733a08111a24293237494c5153565c0000000000000101000000000000000d00000000000000000000000000000078')
     # buf1 = b'y[=\x1f \x00\x00\x00\x00\x00\x01\x00\xcd\x00\x00\x00\x04\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x02\x00\x00\x00\x1c\x00\x00\x00\xbd\x00\x00\x00\x00\x00\x00\x00\xf0\x01\x00\x00\x00\x00\x00\x00\x0c\x00\x00\x00\x00\x00\x00\x00\n\x00\x00\x00\x03\x00\x00\x00)/\x00\x00bplist00\xd4\x01\x02\x03\x04\x05\x06\x07\nY$archiverX$versionX$objectsT$top_\x10\x0fNSKeyedArchiver\x12\x00\x01\x86\xa0\xa2\x08\tU$null_\x10\x15startSamplingWithPid:\xd1\x0b\x0cTroot\x80\x01\x08\x11\x1b$-2DILRjmr\x00\x00\x00\x00\x00\x00\x01\x01\x00\x00\x00\x00\x00\x00\x00\r\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00t'
-    dtx = DTXFragment(buf)
-
-    print(dtx.message)
+    cursor = 0
+    while cursor < len(buf):
+        header = DTXMessageHeader.unpack_from(buf, cursor)
+        cursor += DTXMessageHeader.size
+        fragment = DTXFragment(header)
+        slot = fragment.slot(header)
+        slot[:] = buf[cursor: cursor + header.length]
+        cursor += header.length
+        dtx = fragment.message
+        print(dtx.identifier, selector_to_pyobject(dtx.get_selector()))
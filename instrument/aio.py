@@ -0,0 +1,426 @@
+"""
+基于 asyncio 的 instrument rpc 客户端
+所有连接共用一个事件循环, 不再需要每个连接一个接收线程, 适合一台主机同时驱动多台设备
+"""
+import asyncio
+import inspect
+import socket
+import ssl
+import traceback
+
+from instrument.RPC import DTXFragment, DTXFragmentTable, DTXRouteTable, InstrumentRPCRawArg, \
+    InstrumentRPCResult, InstrumentServiceConnectionLost
+from instrument.bpylist.bplistlib.readwrite import load
+from instrument.dtxlib import DTXMessage, DTXMessageHeader, pyobject_to_auxiliary, pyobject_to_selector
+from util import logging
+from util.exceptions import StartServiceError
+from util.lockdown import LockdownClient
+from util.usbmux import USBMux
+
+log = logging.getLogger(__name__)
+
+_STREAM_END = object()
+
+
+async def get_usb_async_rpc(udid=None, strict=False):
+    rpc = AsyncInstrumentRPC(udid, strict)
+    await rpc.init()
+    return rpc
+
+
+async def open_instrument_stream(lockdown: LockdownClient):
+    """
+    启动 instrument 服务并建立 asyncio stream
+    :param lockdown: 已配对的 LockdownClient
+    :return: (StreamReader, StreamWriter)
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        cli = await loop.run_in_executor(None, lockdown.start_service, "com.apple.instruments.remoteserver")
+        sock = cli.sock
+        if isinstance(sock, ssl.SSLSocket):
+            # remoteserver 协议配对成功之后，需要关闭 ssl 协议通道，使用明文传输
+            sock = socket.socket(fileno=sock.detach())
+        return await asyncio.open_connection(sock=sock)
+    except StartServiceError as E:
+        log.debug(E)
+    resp = await loop.run_in_executor(None, lockdown.start_service_info,
+                                      "com.apple.instruments.remoteserver.DVTSecureSocketProxy")
+    device = await loop.run_in_executor(None, USBMux().find_device, lockdown.udid, 0.1)
+    sock = await loop.run_in_executor(None, device.connect, resp.get('Port'))
+    if not resp.get('EnableServiceSSL', False):
+        return await asyncio.open_connection(sock=sock)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.load_cert_chain(lockdown.sslfile)
+    return await asyncio.open_connection(sock=sock, ssl=context, server_hostname='')
+
+
+class AsyncInstrumentRPC:
+    """
+    InstrumentRPC 的 asyncio 版本, 接口与回调语义保持一致:
+    call / call_noret 变为协程, 回调既可以是普通函数也可以是协程函数, 在接收协程中按顺序执行
+    """
+
+    def __init__(self, udid=None, strict=False, fragment_memory_limit=256 * 1024 * 1024, fragment_max_age=60):
+        """
+        :param udid: 设备 udid
+        :param strict: 调试模式, 接收到的每条 DTX 消息都会重新序列化并与原始数据比对
+        :param fragment_memory_limit: 重组中的多 fragment 消息最多占用的内存, 字节
+        :param fragment_max_age: 多 fragment 消息重组的最长等待时间, 秒, 超时的消息会被丢弃
+        """
+        self.udid = udid
+        self.strict = strict
+        self.lockdown = None
+        self.frames_received = 0
+        self._reader = None
+        self._writer = None
+        self._recv_task = None
+        self._callbacks = {}
+        self._routes = DTXRouteTable()
+        self._unhanled_callback = None
+        self._sync_waits = {}
+        self._next_identifier = 1
+        self._channels = {}
+        self._channel_requests = {}
+        self._next_channel_id = 1
+        self._streams = set()
+        self._receiver_exiting = False
+        self._fragments = DTXFragmentTable(fragment_memory_limit, fragment_max_age)
+
+    async def init(self):
+        """
+        初始化 instrument rpc 服务, lockdown 与 usbmux 的阻塞调用在线程池中执行
+        :return: bool 是否成功
+        """
+        if self.lockdown is None:
+            loop = asyncio.get_running_loop()
+            self.lockdown = await loop.run_in_executor(None, lambda: LockdownClient(udid=self.udid))
+        reader, writer = await open_instrument_stream(self.lockdown)
+        self.init_stream(reader, writer)
+        return True
+
+    def init_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        使用已经建立好的 stream 初始化, 例如转发到本地的端口
+        """
+        self._reader = reader
+        self._writer = writer
+
+    async def deinit(self):
+        """
+        反初始化 instrument rpc 服务
+        :return: 无返回值
+        """
+        await self.stop()
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+            self._writer = None
+
+    def start(self):
+        """
+        启动接收协程, 需要在事件循环中调用
+        :return: bool 是否成功
+        """
+        if self._recv_task:
+            return True
+        self._recv_task = asyncio.get_running_loop().create_task(self._receiver())
+        return True
+
+    async def stop(self):
+        """
+        停止接收协程
+        :return: 无返回值
+        """
+        if self._recv_task:
+            self._recv_task.cancel()
+            try:
+                await self._recv_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as E:  # 接收协程的异常已经在退出时输出, 不影响停止
+                log.debug(E)
+            self._recv_task = None
+
+    async def wait_closed(self):
+        """
+        等待连接断开
+        """
+        if self._recv_task:
+            await asyncio.shield(self._recv_task)
+
+    def register_callback(self, selector, callback):
+        """
+        注册回调, 接受 instrument server 到 client 的远程调用
+        :parma selector: 字符串, selector 名称
+        :param callback: 回调函数或协程函数, 接受一个参数, 类型是 InstrumentRPCResult 对象实例
+        :return: 无返回值
+        """
+        self._callbacks[selector] = callback
+
+    async def register_channel_callback(self, channel, callback):
+        """
+        注册回调, 接受 instrument server 到 client 的远程调用
+        :parma channel: 字符串, channel 名称
+        :param callback: 回调函数或协程函数, 接受一个参数, 类型是 InstrumentRPCResult 对象实例
+        :return: 无返回值
+        """
+        channel_id = await self._make_channel(channel)
+        self._routes.set_channel(channel_id, callback)
+
+    def register_unhandled_callback(self, callback):
+        """
+        注册回调, 接受 instrument server 到 client 的远程调用, 处理所以未被处理的消息
+        :param callback: 回调函数或协程函数, 接受一个参数, 类型是 InstrumentRPCResult 对象实例
+        :return: 无返回值
+        """
+        self._unhanled_callback = callback
+
+    async def channel_messages(self, channel, maxsize=0):
+        """
+        以异步迭代器的方式接收 channel 消息, 连接断开时迭代结束:
+            async for res in rpc.channel_messages("com.apple.instruments.server.services.sysmontap"):
+                ...
+        会替换该 channel 已注册的回调, 队列满时接收协程会等待消费者
+        :param channel: 字符串, channel 名称
+        :param maxsize: 队列长度, 0 表示不限制
+        """
+        queue = asyncio.Queue(maxsize)
+        channel_id = await self._make_channel(channel)
+        self._routes.set_channel(channel_id, queue.put)
+        self._streams.add(queue)
+        try:
+            while not (self._receiver_exiting and queue.empty()):
+                res = await queue.get()
+                if res is _STREAM_END:
+                    break
+                yield res
+        finally:
+            self._streams.discard(queue)
+            if self._routes.get_channel(channel_id) == queue.put:
+                self._routes.pop_channel(channel_id)
+
+    async def _make_channel(self, channel: str):
+        if channel is None:
+            return 0
+        if channel in self._channels:
+            return self._channels[channel]
+        if channel in self._channel_requests:
+            # 同一个 channel 的并发请求只发送一次
+            return await asyncio.shield(self._channel_requests[channel])
+
+        channel_id = self._next_channel_id
+        self._next_channel_id += 1
+        request = asyncio.get_running_loop().create_future()
+        self._channel_requests[channel] = request
+        try:
+            dtx = await self._call(True, 0, "_requestChannelWithCode:identifier:", channel_id, channel)
+            if dtx.get_selector():
+                print("Make Channel Error:", load(dtx.get_selector()))
+                raise RuntimeError("failed to make channel")
+            self._channels[channel] = channel_id
+            request.set_result(channel_id)
+            return channel_id
+        except BaseException as E:
+            request.set_exception(E)
+            request.exception()
+            raise
+        finally:
+            self._channel_requests.pop(channel)
+
+    async def open_channels(self, channels, timeout=None) -> dict:
+        """
+        一次发出所有 channel 请求, 再一起等待回复
+        :param channels: channel 名称列表
+        :param timeout: 等待回复的超时时间, 秒, 超时抛出 asyncio.TimeoutError
+        :return: {channel 名称: 从发出请求到收到回复的耗时, 秒}, 已经建立的 channel 耗时为 0
+        """
+        loop = asyncio.get_running_loop()
+        begin = loop.time()
+
+        async def open_channel(channel):
+            if channel in self._channels:
+                return channel, 0.0
+            await self._make_channel(channel)
+            return channel, loop.time() - begin
+
+        return dict(await asyncio.wait_for(asyncio.gather(*map(open_channel, channels)), timeout))
+
+    async def call(self, channel: str, selector: str, *auxiliaries):
+        channel_id = await self._make_channel(channel)
+        ret = await self._call(True, channel_id, selector, *auxiliaries)
+        return InstrumentRPCResult(ret)
+
+    async def call_noret(self, channel: str, selector: str, *auxiliaries):
+        channel_id = await self._make_channel(channel)
+        await self._call(False, channel_id, selector, *auxiliaries)
+
+    async def _call(self, sync: bool, channel_id: int, selector: str, *auxiliaries):
+        """
+        :param sync: 是否等待回复
+        :param channel_id: 通道标识
+        :param selector: 请求方法名称，method name
+        :param auxiliaries:
+        :return: DTXMessage
+        """
+        if self._receiver_exiting:
+            raise RuntimeWarning("rpc service died")
+        dtx = DTXMessage()
+        dtx.identifier = self._next_identifier
+        self._next_identifier += 1
+        dtx.channel_code = channel_id
+        dtx.set_selector(pyobject_to_selector(selector))
+        wait_key = (dtx.channel_code, dtx.identifier)
+        for aux in auxiliaries:
+            if type(aux) is InstrumentRPCRawArg:
+                dtx.add_auxiliary(aux.data)
+            else:
+                dtx.add_auxiliary(pyobject_to_auxiliary(aux))
+        if sync:
+            dtx.expects_reply = True
+            result = asyncio.get_running_loop().create_future()
+            self._sync_waits[wait_key] = result
+        try:
+            await self._send_dtx(dtx)
+            if sync:
+                return await result
+        finally:
+            if sync:
+                self._sync_waits.pop(wait_key, None)
+
+    async def _send_dtx(self, dtx: DTXMessage):
+        self._writer.writelines(dtx.to_buffers())
+        await self._writer.drain()
+
+    async def _recv_dtx(self):
+        reader = self._reader
+        while 1:
+            try:
+                header = DTXMessageHeader.unpack_from(await reader.readexactly(DTXMessageHeader.size))
+                self.frames_received += 1
+                key = (header.channelCode, header.identifier)
+                if header.fragmentId == 0:
+                    if not self._fragments.reserve(key, header):
+                        # 超过内存上限的消息不分配 payload, 丢弃 body
+                        if header.fragmentCount == 1:
+                            await self._discard(header.length)
+                        continue
+                    fragment = DTXFragment(header, self.strict)
+                    if header.fragmentCount > 1:
+                        self._fragments.add(key, fragment)
+                        continue
+                else:
+                    fragment = self._fragments.get(key)
+                    if fragment is None:
+                        # 所属消息已被淘汰, 丢弃 body 保持数据流对齐
+                        await self._discard(header.length)
+                        continue
+                try:
+                    body = fragment.slot(header)
+                except (AssertionError, ValueError) as E:
+                    # fragment 顺序或长度不符, 丢弃整条消息, body 照常读出保持数据流对齐
+                    log.error('丢弃 fragment 异常的 DTX 消息: key %s: %r', key, E)
+                    self._fragments.pop(key)
+                    await self._discard(header.length)
+                    continue
+                body[:] = await reader.readexactly(header.length)
+            except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError) as E:
+                log.debug(E)
+                return None
+            if fragment.completed:
+                self._fragments.pop(key)
+                try:
+                    return fragment.message
+                except Exception as E:
+                    # 整条消息已经读出, 数据流仍然对齐, 跳过这条消息继续接收
+                    log.error('丢弃无法解析的 DTX 消息: channel %d identifier %d: %r',
+                              header.channelCode, header.identifier, E)
+
+    async def _discard(self, length: int):
+        """
+        分段读取并丢弃 length 字节, 不按 length 分配内存
+        """
+        while length > 0:
+            length -= len(await self._reader.readexactly(min(length, 64 * 1024)))
+
+    async def _receiver(self):
+        try:
+            while 1:
+                dtx = await self._recv_dtx()
+                if dtx is None:
+                    break
+                self._next_identifier = max(self._next_identifier, dtx.identifier + 1)
+                await self._dispatch(dtx)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._receiver_exiting = True  # to block incoming calls
+            for result in self._sync_waits.values():
+                if not result.done():
+                    result.set_result(InstrumentServiceConnectionLost)
+            for queue in self._streams:
+                try:
+                    queue.put_nowait(_STREAM_END)
+                except asyncio.QueueFull:
+                    pass
+
+    async def _dispatch(self, dtx: DTXMessage):
+        wait_key = (dtx.channel_code, dtx.identifier)
+        if wait_key in self._sync_waits:
+            result = self._sync_waits[wait_key]
+            if not result.done():
+                result.set_result(dtx)
+            return
+        callback = self._routes.channel(dtx.channel_code)
+        if callback:
+            try:
+                await _invoke(callback, InstrumentRPCResult(dtx))
+            except Exception:
+                traceback.print_exc()
+            return
+        callback = self._callbacks.get(self._routes.selector(dtx)) if self._callbacks else None
+        if callback:
+            try:
+                ret = await _invoke(callback, InstrumentRPCResult(dtx))
+                if dtx.expects_reply:
+                    reply = dtx.new_reply()
+                    reply.set_selector(pyobject_to_selector(ret))
+                    reply._payload_header.flags = 0x3
+                    await self._send_dtx(reply)
+            except Exception:
+                traceback.print_exc()
+        elif self._unhanled_callback:
+            try:
+                await _invoke(self._unhanled_callback, InstrumentRPCResult(dtx))
+            except Exception:
+                traceback.print_exc()
+
+
+async def _invoke(callback, res):
+    ret = callback(res)
+    if inspect.isawaitable(ret):
+        ret = await ret
+    return ret
+
+
+async def pre_call(rpc: AsyncInstrumentRPC):
+    done = asyncio.Event()
+
+    def _notifyOfPublishedCapabilities(res):
+        done.set()
+
+    def dropped_message(res):
+        print("[DROP]", res.parsed, res.raw.channel_code)
+
+    rpc.register_callback("_notifyOfPublishedCapabilities:", _notifyOfPublishedCapabilities)
+    rpc.register_unhandled_callback(dropped_message)
+    rpc.start()
+    try:
+        await asyncio.wait_for(done.wait(), 5)
+    except asyncio.TimeoutError:
+        print("[WARN] timeout waiting capabilities")
@@ -19,6 +19,11 @@ def unarchive(plist: bytes) -> object:
     return Unarchive(plist).top_object()
 
 
+def unarchive_plist(plist: dict) -> object:
+    "Like unarchive(plist), but for an archive that has already been loaded with bplistlib.load."
+    return Unarchive(None, plist).top_object()
+
+
 def unarchive_file(path: str) -> object:
     "A convenience for unarchive(plist) which loads an archive from a file for you"
     with open(path, 'rb') as fd:
@@ -215,14 +220,17 @@ class Unarchive:
     is non-trivial, and I don't want to have a mess of special cases.
     """
 
-    def __init__(self, input: bytes):
+    def __init__(self, input: bytes, plist: dict = None):
         self.input = input
+        self.plist = plist
         self.unpacked_uids = {}
         self.top_uid = null_uid
         self.objects = None
 
     def unpack_archive_header(self):
-        plist = load(self.input)
+        plist = load(self.input) if self.plist is None else self.plist
+        if not isinstance(plist, dict):
+            raise MissingTopObject(plist)
         archiver = plist.get('$archiver')
         if archiver != 'NSKeyedArchiver':
             raise UnsupportedArchiver(archiver)
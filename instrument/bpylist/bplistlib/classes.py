@@ -5,12 +5,13 @@ a binary plist file.
 """
 
 from datetime import datetime
-from struct import pack, unpack
+from struct import calcsize, pack, pack_into, unpack_from
 from time import mktime
 
 from ._types import uid, Fill, FillType, unicode
-from .functions import find_with_type, get_byte_width
+from .functions import get_byte_width, object_key
 from .functions import flatten_object_list, unflatten_reference_list
+from .functions import unpack_references
 
 
 class BooleanHandler(object):
@@ -35,7 +36,7 @@ class BooleanHandler(object):
         """Return an empty string."""
         return b''
 
-    def decode_body(self, raw, object_length):
+    def decode_body(self, buffer, offset, object_length):
         """Return the decoded boolean value."""
         return self.integer_to_boolean[object_length]
 
@@ -54,10 +55,10 @@ class IntegerHandler(object):
         limits = [2 ** bit_length for bit_length in bit_lengths]
         for index, limit in enumerate(limits):
             if index == 0:
-                if 0 <= integer <= limit:
+                if 0 <= integer < limit:
                     return index
             else:
-                if limits[index - 1] < integer <= limit:
+                if limits[index - 1] <= integer < limit:
                     return index
         raise ValueError
 
@@ -69,11 +70,12 @@ class IntegerHandler(object):
         """Pack the given number appropriately for the object length."""
         return pack(self.formats[object_length], value)
 
-    def decode_body(self, raw, object_length):
-        """Unpack the encoded number appropriately for the object length."""
+    def decode_body(self, buffer, offset, object_length):
+        """Unpack the number at offset appropriately for the object length."""
         if object_length > 3:
-            return int.from_bytes(raw, "big")
-        return unpack(self.formats[object_length], raw)[0]
+            end = offset + self.get_byte_length(object_length)
+            return int.from_bytes(buffer[offset:end], "big")
+        return unpack_from(self.formats[object_length], buffer, offset)[0]
 
 
 class FloatHandler(IntegerHandler):
@@ -103,8 +105,8 @@ class FloatHandler(IntegerHandler):
         body = IntegerHandler.encode_body(self, float_, object_length)
         return body[::-1]
 
-    def decode_body(self, raw, object_length):
-        return IntegerHandler.decode_body(self, raw, object_length)
+    def decode_body(self, buffer, offset, object_length):
+        return IntegerHandler.decode_body(self, buffer, offset, object_length)
 
 
 class DateHandler(FloatHandler):
@@ -127,8 +129,8 @@ class DateHandler(FloatHandler):
         seconds = self.convert_to_seconds(date)
         return FloatHandler.encode_body(self, seconds, object_length)
 
-    def decode_body(self, raw, object_length):
-        seconds = FloatHandler.decode_body(self, raw, object_length)
+    def decode_body(self, buffer, offset, object_length):
+        seconds = FloatHandler.decode_body(self, buffer, offset, object_length)
         return self.convert_to_date(seconds)
 
     def convert_to_seconds(self, date):
@@ -162,9 +164,9 @@ class DataHander(object):
         """Get the binary data from the Data object."""
         return data.data
 
-    def decode_body(self, raw, object_length):
+    def decode_body(self, buffer, offset, object_length):
         """Store the binary data in a Data object."""
-        return bytearray(raw)
+        return bytearray(buffer[offset:offset + object_length])
 
 
 class StringHandler(object):
@@ -187,9 +189,9 @@ class StringHandler(object):
         """Return the encoded version of string, according to self.encoding."""
         return string.encode(self.encoding)
 
-    def decode_body(self, string, object_length):
-        """Return string."""
-        return string
+    def decode_body(self, buffer, offset, object_length):
+        """Return a copy of the raw string."""
+        return bytes(buffer[offset:offset + object_length])
 
 
 class UnicodeStringHandler(StringHandler):
@@ -205,9 +207,10 @@ class UnicodeStringHandler(StringHandler):
         """Return twice the object length."""
         return object_length * 2
 
-    def decode_body(self, raw, object_length):
+    def decode_body(self, buffer, offset, object_length):
         """Decode the raw string according to self.encoding."""
-        return raw.decode(self.encoding)
+        end = offset + self.get_byte_length(object_length)
+        return str(buffer[offset:end], self.encoding)
 
 
 class UIDHandler(IntegerHandler):
@@ -225,10 +228,10 @@ class UIDHandler(IntegerHandler):
         limits = [2 ** bit_length for bit_length in bit_lengths]
         for index, limit in enumerate(limits):
             if index == 0:
-                if 0 <= uid <= limit:
+                if 0 <= uid < limit:
                     return index
             else:
-                if limits[index - 1] < uid <= limit:
+                if limits[index - 1] <= uid < limit:
                     return index
         raise ValueError
 
@@ -237,9 +240,9 @@ class UIDHandler(IntegerHandler):
         value = int(uid)
         return IntegerHandler.encode_body(self, value, object_length)
 
-    def decode_body(self, raw, object_length):
+    def decode_body(self, buffer, offset, object_length):
         """Decode an integer value and put in a UID object."""
-        value = IntegerHandler.decode_body(self, raw, object_length)
+        value = IntegerHandler.decode_body(self, buffer, offset, object_length)
         return uid(value)
 
 
@@ -250,7 +253,7 @@ class ArrayHandler(object):
         self.type_number = 0xa
         self.types = list
         self.object_handler = object_handler
-        self.formats = (None, 'B', 'H')
+        self.formats = (None, 'B', 'H', None, 'L')
         self.endian = '>'
         self.format = None
         self.reference_size = None
@@ -269,11 +272,10 @@ class ArrayHandler(object):
         encoded = pack(format_, *array)
         return encoded
 
-    def decode_body(self, raw, object_length):
+    def decode_body(self, buffer, offset, object_length):
         """Decode the reference list into a flattened array."""
-        format_ = self.endian + self.format * object_length
-        array = unpack(format_, raw)
-        return list(array)
+        return unpack_references(buffer, offset, object_length,
+                                 self.reference_size)
 
     def set_reference_size(self, reference_size):
         """Save the given reference size, and set self.format appropriately."""
@@ -282,11 +284,11 @@ class ArrayHandler(object):
 
     def flatten(self, array, objects):
         """Flatten the array into a list of references."""
-        return flatten_object_list(array, objects)
+        return flatten_object_list(array, self.object_handler.references)
 
     def unflatten(self, array, objects):
         """Unflatten the list of references into a list of objects."""
-        return unflatten_reference_list(array, objects, self.object_handler)
+        return unflatten_reference_list(array, objects)
 
     def collect_children(self, array, objects):
         """Collect all the items in the array."""
@@ -313,14 +315,14 @@ class DictionaryHandler(ArrayHandler):
                                           object_length)
         return keys + values
 
-    def decode_body(self, raw, object_length):
+    def decode_body(self, buffer, offset, object_length):
         """
-        Decode the two reference lists in raw into a flattened dictionary.
+        Decode the two reference lists at offset into a flattened dictionary.
         """
-        half = ArrayHandler.get_byte_length(self, object_length)
-        keys = ArrayHandler.decode_body(self, raw[:half], object_length)
-        values = ArrayHandler.decode_body(self, raw[half:], object_length)
-        return dict(zip(keys, values))
+        references = unpack_references(buffer, offset, object_length * 2,
+                                       self.reference_size)
+        return dict(zip(references[:object_length],
+                        references[object_length:]))
 
     def flatten(self, dictionary, objects):
         """Flatten a dictionary into a dictionary of references."""
@@ -353,7 +355,7 @@ class ObjectHandler(object):
         self.size_handler.type_number = 1
         self.handlers_by_type_number = {}
         self.handlers_by_type = {}
-        self.file_object = bytes()
+        self.references = {}
         for handler in handlers:
             self.handlers_by_type_number.update({handler.type_number: handler})
             if type(handler.types) == type:
@@ -378,16 +380,17 @@ class ObjectHandler(object):
         body = handler.encode_body(object_, object_length)
         return first_byte + body
 
-    def decode(self, file_object, handler=None):
-        """Start reading in file_object, and decode the object found."""
-        self.file_object = file_object
-        object_type, object_length = self.decode_first_byte(self.file_object)
+    def decode(self, buffer, offset=0, handler=None):
+        """
+        Decode the object found at offset in buffer. The buffer is never
+        sliced ahead of the object, so buffer should be a memoryview to avoid
+        copies when decoding many objects.
+        """
+        object_type, object_length, offset = self.decode_first_byte(buffer,
+                                                                    offset)
         if handler is None:
             handler = self.handlers_by_type_number[object_type]
-        byte_length = handler.get_byte_length(object_length)
-        raw = self.file_object[:byte_length]
-        self.file_object = self.file_object[byte_length:]
-        return handler.decode_body(raw, object_length)
+        return handler.decode_body(buffer, offset, object_length)
 
     def flatten_objects(self, objects):
         """Flatten all objects in objects."""
@@ -428,32 +431,78 @@ class ObjectHandler(object):
             return encoded + real_length
         return encoded
 
-    def decode_first_byte(self, file_object):
+    def decode_first_byte(self, buffer, offset):
         """
         Get the type number and object length from the first byte of an object.
         Boolean type objects never encode as more than one byte.
+        Also return the offset of the object body.
         """
-        c = file_object[0:1]
-        self.file_object = file_object[1:]
-        value = unpack('B', c)[0]
+        value = buffer[offset]
         object_type = value >> 4
         object_length = value & 0xF
+        offset += 1
         if object_length == 15 and object_type != 0:
-            object_length = self.decode(self.file_object, handler=self.size_handler)
-        return object_type, object_length
+            size_length = buffer[offset] & 0xF
+            object_length = self.decode(buffer, offset,
+                                        handler=self.size_handler)
+            offset += 1 + self.size_handler.get_byte_length(size_length)
+        return object_type, object_length, offset
 
     def collect_objects(self, object_, objects):
         """
         Collect all the objects in object_ into objects, using the appropriate
-        handler.
+        handler. self.references maps the key of every collected object to its
+        index in objects.
+        """
+        key = object_key(object_)
+        if key in self.references:
+            return
+        self.references[key] = len(objects)
+        objects.append(object_)
+        if type(object_) in (dict, list):
+            handler = self.handlers_by_type[type(object_)]
+            handler.collect_children(object_, objects)
+
+
+_undecoded = object()
+
+
+class ObjectTable(object):
+    """
+    The flattened objects of a binary plist, indexed by reference. Each object
+    is decoded from the buffer the first time it is looked up, so objects that
+    are not reachable from the root are never decoded.
+    """
+
+    def __init__(self, buffer, offsets, object_handler):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.object_handler = object_handler
+        self.objects = [_undecoded] * len(offsets)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __getitem__(self, reference):
+        object_ = self.objects[reference]
+        if object_ is _undecoded:
+            object_ = self.object_handler.decode(self.buffer,
+                                                 self.offsets[reference])
+            self.objects[reference] = object_
+        return object_
+
+    def unflatten(self, reference):
         """
-        try:
-            find_with_type(object_, objects)
-        except ValueError:
-            objects.append(object_)
-            if type(object_) in (dict, list):
-                handler = self.handlers_by_type[type(object_)]
-                handler.collect_children(object_, objects)
+        Return the unflattened object at reference. Scalars and strings are
+        built once and shared by every reference to them; lists and dicts are
+        rebuilt for each reference, so that no container is aliased.
+        """
+        object_ = self[reference]
+        if type(object_) in (list, dict):
+            return self.object_handler.unflatten(object_, self)
+        if type(object_) is bytes:
+            object_ = self.objects[reference] = object_.decode()
+        return object_
 
 
 class TableHandler(object):
@@ -463,36 +512,31 @@ class TableHandler(object):
         self.formats = (None, 'B', 'H', 'BBB', 'L')
         self.endian = '>'
 
-    def decode(self, file_object, offset_size, length, table_offset):
+    def decode(self, buffer, offset_size, length, table_offset):
         """
-        Decode the offset table in file_object. Returns a list of offsets.
+        Decode the offset table in buffer. Returns a list of offsets.
         """
-        file_object = file_object[table_offset:]
-        offset_format = self.formats[offset_size]
-        table_format = self.endian + offset_format * length
-        raw = file_object[:offset_size * length]
-        offsets = unpack(table_format, raw)
-        if offset_size == 3:
-            zip_args = [offsets[x::3] for x in range(3)]
-            offsets = zip(*zip_args)
-            offsets = [o[0] * 0x10000 + o[1] * 0x100 + o[2] for o in offsets]
-        return offsets
+        return unpack_references(buffer, table_offset, length, offset_size)
 
-    def encode(self, offsets, table_offset):
-        """Return the encoded form of a list of offsets."""
+    def encode_into(self, buf, offsets):
+        """
+        Append the encoded offset table to the bytearray buf with a single
+        pack_into. The table starts at the current end of buf.
+        """
+        table_offset = len(buf)
         offset_size = get_byte_width(table_offset, 4)
         offset_format = self.formats[offset_size]
         table_format = self.endian + offset_format * len(offsets)
         if offset_size == 3:
             new_offsets = []
-            for offset in offsets[:]:
+            for offset in offsets:
                 first = offset // 0x10000
                 second = (offset % 0x10000) // 0x100
                 third = (offset % 0x10000) % 0x100
                 new_offsets += [first, second, third]
             offsets = new_offsets
-        encoded = pack(table_format, *offsets)
-        return encoded
+        buf += bytes(calcsize(table_format))
+        pack_into(table_format, buf, table_offset, *offsets)
 
 
 class TrailerHandler(object):
@@ -501,10 +545,9 @@ class TrailerHandler(object):
     def __init__(self):
         self.format = '>6xBB4xL4xL4xL'
 
-    def decode(self, file_object):
-        """Decode the final 32 bytes of file_object."""
-        file_object = file_object[-32:]
-        trailer = unpack(self.format, file_object)
+    def decode(self, buffer):
+        """Decode the final 32 bytes of buffer."""
+        trailer = unpack_from(self.format, buffer, len(buffer) - 32)
         return trailer
 
     def encode(self, offsets, table_offset):
@@ -1,5 +1,13 @@
 # encoding: utf-8
 """This file contains private functions for the bplistlib module."""
+import sys
+from array import array
+from functools import lru_cache
+from struct import Struct
+
+# below this many items a cached Struct is faster than an array round trip
+BULK_DECODE_MIN = 128
+ARRAY_TYPECODES = {array(code).itemsize: code for code in ('H', 'I', 'L', 'Q')}
 
 
 def get_byte_width(value_to_store, max_byte_width):
@@ -13,34 +21,55 @@ def get_byte_width(value_to_store, max_byte_width):
     raise ValueError
 
 
-def find_with_type(value, list_):
+def object_key(value):
     """
-    Find value in list_, matching both for equality and type, and
-    return the index it was found at. If not found, raise ValueError.
+    Return the key of value in a reference index. Values match on both
+    equality and type; unhashable values (lists, dicts) match on identity.
     """
-    for index, comparison_value in enumerate(list_):
-        if (type(value) == type(comparison_value) and
-                value == comparison_value):
-            return index
-    raise ValueError
+    try:
+        hash(value)
+    except TypeError:
+        return id(value)
+    return type(value), value
 
 
-def flatten_object_list(object_list, objects):
+def flatten_object_list(object_list, references):
     """Convert a list of objects to a list of references."""
-    reference_list = []
-    for object_ in object_list:
-        reference = find_with_type(object_, objects)
-        reference_list.append(reference)
-    return reference_list
+    return [references[object_key(object_)] for object_ in object_list]
+
+
+@lru_cache(maxsize=1024)
+def reference_struct(size, count):
+    """Return a compiled Struct for count big-endian integers of size bytes."""
+    return Struct('>' + {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}[size] * count)
+
+
+def unpack_references(buffer, offset, count, size):
+    """
+    Decode count big-endian unsigned integers of size bytes each, starting
+    at offset in buffer, and return them as a list. Used for the offset
+    table and for array and dictionary references. Large runs are decoded
+    in bulk through array, and 3 byte integers are widened to 4 bytes with
+    slice assignments instead of a per-item loop.
+    """
+    end = offset + count * size
+    if size == 1:
+        return list(buffer[offset:end])
+    if count < BULK_DECODE_MIN and size != 3:
+        return list(reference_struct(size, count).unpack_from(buffer, offset))
+    raw = buffer[offset:end]
+    if size == 3:
+        wide = bytearray(count * 4)
+        for index in range(3):
+            wide[index + 1::4] = raw[index::3]
+        raw, size = wide, 4
+    items = array(ARRAY_TYPECODES[size])
+    items.frombytes(raw)
+    if sys.byteorder == 'little':
+        items.byteswap()
+    return items.tolist()
 
 
-def unflatten_reference_list(references, objects, object_handler):
+def unflatten_reference_list(references, objects):
     """Convert a list of references to a list of objects."""
-    object_list = []
-    for reference in references:
-        item = objects[reference]
-        if isinstance(item, bytes):
-            item = item.decode()
-        item = object_handler.unflatten(item, objects)
-        object_list.append(item)
-    return object_list
+    return [objects.unflatten(reference) for reference in references]
@@ -2,20 +2,21 @@
 """This file contains private read/write functions for the bplistlib module."""
 import plistlib
 
-from instrument.bpylist.bplistlib.classes import ObjectHandler, TableHandler
+from instrument.bpylist.bplistlib.classes import ObjectHandler, ObjectTable, TableHandler
 from instrument.bpylist.bplistlib.classes import TrailerHandler
 from instrument.bpylist.bplistlib.functions import get_byte_width
 
 
 def read(file_object):
     """
-    Read a binary plist from an open file object that supports seeking.
-    Return the root object.
+    Read a binary plist from a bytes-like object and return the root object.
+    All sections are decoded in place through a single memoryview.
     """
-    trailer = read_trailer(file_object)
+    buffer = memoryview(file_object)
+    trailer = read_trailer(buffer)
     offset_size, reference_size, length, root, table_offset = trailer
-    offsets = read_table(file_object, offset_size, length, table_offset)
-    root_object = read_objects(file_object, offsets, reference_size, root)
+    offsets = read_table(buffer, offset_size, length, table_offset)
+    root_object = read_objects(buffer, offsets, reference_size, root)
     return root_object
 
 
@@ -37,15 +38,14 @@ def read_table(file_object, offset_size, length, table_offset):
     return offsets
 
 
-def read_objects(file_object, offsets, reference_size, root):
-    """Read from an open file_object and return the decoded root object."""
+def read_objects(buffer, offsets, reference_size, root):
+    """
+    Return the decoded root object. Only objects reachable from the root are
+    decoded.
+    """
     object_handler = ObjectHandler()
     object_handler.set_reference_size(reference_size)
-    objects = []
-    for offset in offsets:
-        buf = file_object[offset:]
-        object_ = object_handler.decode(buf)
-        objects.append(object_)
+    objects = ObjectTable(buffer, offsets, object_handler)
     root_object = objects[root]
     return object_handler.unflatten(root_object, objects)
 
@@ -54,15 +54,17 @@ def generate(root_object):
     """
     return bplist buf
     """
-    buf = b'bplist00'
-    buf, offsets = write_objects(buf, root_object)
-    buf, table_offset = write_table(buf, offsets)
-    return write_trailer(buf, offsets, table_offset)
+    buf = bytearray(b'bplist00')
+    offsets = write_objects(buf, root_object)
+    table_offset = write_table(buf, offsets)
+    write_trailer(buf, offsets, table_offset)
+    return bytes(buf)
 
 
 def write_objects(buf, root_object):
     """
-    Flatten all objects, encode, and write the encoded objects to file_object.
+    Flatten all objects, encode, and append the encoded objects to buf, a
+    bytearray. Return the offset of every object.
     """
     objects = []
     object_handler = ObjectHandler()
@@ -70,29 +72,25 @@ def write_objects(buf, root_object):
     object_handler.flatten_objects(objects)
     reference_size = get_byte_width(len(objects), 2)
     object_handler.set_reference_size(reference_size)
-    offsets = []
-    for object_ in objects:
-        offsets.append(len(buf))
-        encoded_object = object_handler.encode(object_)
-        buf += encoded_object
-    return buf, offsets
+    offsets = [0] * len(objects)
+    for index, object_ in enumerate(objects):
+        offsets[index] = len(buf)
+        buf += object_handler.encode(object_)
+    return offsets
 
 
 def write_table(buf, offsets):
-    """Encode the offsets and write to file_object."""
+    """Encode the offsets into buf and return the offset of the table."""
     table_handler = TableHandler()
     table_offset = len(buf)
-    table = table_handler.encode(offsets, table_offset)
-    buf += table
-    return buf, table_offset
+    table_handler.encode_into(buf, offsets)
+    return table_offset
 
 
 def write_trailer(buf, offsets, table_offset):
-    """Encode the trailer section and write to file_object."""
+    """Encode the trailer section into buf."""
     trailer_handler = TrailerHandler()
-    trailer = trailer_handler.encode(offsets, table_offset)
-    buf += trailer
-    return buf
+    buf += trailer_handler.encode(offsets, table_offset)
 
 
 def load(fp, binary=None):
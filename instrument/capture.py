@@ -0,0 +1,153 @@
+"""
+DTX 数据流抓包与回放
+抓包文件格式:
+1.文件头 8 字节 magic
+2.若干条记录, 每条记录为 <时间戳 double, 方向 uint8, 长度 uint32> + 原始数据
+  接收方向的每条记录是一个完整的 DTX fragment (header + body), 发送方向的每条记录是一条完整的 DTX 消息
+"""
+import struct
+import time
+from threading import Lock
+
+from instrument.dtxlib import DTXMessage, selector_to_pyobject
+
+CAPTURE_MAGIC = b'DTXCAP\x00\x01'
+DIRECTION_RECV = 0
+DIRECTION_SEND = 1
+_record_header = struct.Struct('<dBI')
+
+
+class DTXCaptureWriter:
+    """ 追加写入抓包记录, 接收线程与调用线程可以同时写入 """
+
+    def __init__(self, path: str):
+        self._fp = open(path, 'wb')
+        self._fp.write(CAPTURE_MAGIC)
+        self._lock = Lock()
+        self.records = 0
+
+    def write(self, direction: int, *buffers):
+        self.write_at(time.time(), direction, *buffers)
+
+    def write_at(self, timestamp: float, direction: int, *buffers):
+        length = sum(len(buf) for buf in buffers)
+        with self._lock:
+            if self._fp is None:
+                return
+            self._fp.write(_record_header.pack(timestamp, direction, length))
+            for buf in buffers:
+                self._fp.write(buf)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._fp:
+                self._fp.close()
+                self._fp = None
+
+
+class DTXCaptureReader:
+    """ 顺序读取抓包记录 """
+
+    def __init__(self, path: str):
+        self._fp = open(path, 'rb')
+        if self._fp.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            self._fp.close()
+            raise ValueError(f"not a DTX capture file: {path}")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        head = self._fp.read(_record_header.size)
+        if len(head) < _record_header.size:
+            raise StopIteration
+        timestamp, direction, length = _record_header.unpack(head)
+        data = self._fp.read(length)
+        if len(data) < length:
+            raise StopIteration
+        return timestamp, direction, data
+
+    def close(self):
+        self._fp.close()
+
+
+def read_channels(path: str) -> dict:
+    """
+    从抓包中发送方向的 _requestChannelWithCode:identifier: 请求恢复 channel 名称与编号的对应关系
+    :return: {channel 名称: channel 编号}
+    """
+    channels = {}
+    reader = DTXCaptureReader(path)
+    try:
+        for _, direction, data in reader:
+            if direction != DIRECTION_SEND:
+                continue
+            dtx = DTXMessage.from_bytes(data)
+            if dtx.channel_code != 0 or dtx.get_auxiliary_count() != 2:
+                continue
+            try:
+                if selector_to_pyobject(dtx.get_selector()) != "_requestChannelWithCode:identifier:":
+                    continue
+                channels[dtx.aux(1)] = dtx.aux(0)
+            except Exception:
+                continue
+    finally:
+        reader.close()
+    return channels
+
+
+class DTXReplayClient:
+    """
+    回放用的 instrument client, 按记录顺序返回接收方向的数据
+    speed 为 None 时以最快速度回放, 否则按原始时间间隔除以 speed 回放
+    """
+
+    def __init__(self, path: str, speed=None):
+        self.path = path
+        self.speed = speed
+        self._reader = DTXCaptureReader(path)
+        self._pending = memoryview(b'')
+        self._first_timestamp = None
+        self._started = None
+        self._next = None
+
+    def _next_record(self, timeout):
+        if self._next is None:
+            for timestamp, direction, data in self._reader:
+                if direction == DIRECTION_RECV:
+                    self._next = (timestamp, data)
+                    break
+            else:
+                return None
+        timestamp, data = self._next
+        if self.speed:
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+                self._started = time.monotonic()
+            delay = self._started + (timestamp - self._first_timestamp) / self.speed - time.monotonic()
+            if delay > 0:
+                if 0 < timeout < delay:
+                    time.sleep(timeout)
+                    return None
+                time.sleep(delay)
+        self._next = None
+        return data
+
+    def recv_into(self, buffer, timeout=-1) -> int:
+        if not self._pending:
+            data = self._next_record(timeout)
+            if data is None:
+                return 0
+            self._pending = memoryview(data)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def recv(self, length=4096, timeout=-1) -> bytes:
+        buffer = bytearray(length)
+        return bytes(buffer[:self.recv_into(buffer, timeout)])
+
+    def close(self):
+        self._reader.close()
@@ -0,0 +1,123 @@
+"""
+回调分发: 接收线程只负责解析与路由, 回调在线程池中执行
+每个 channel 一个有界队列, 同一 channel 的消息按接收顺序依次处理, 不同 channel 之间并行
+"""
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+DISPATCH_BLOCK = 'block'  # 队列满时接收线程等待
+DISPATCH_DROP_OLDEST = 'drop_oldest'  # 队列满时丢弃最早的消息
+DISPATCH_DROP_NEWEST = 'drop_newest'  # 队列满时丢弃新到的消息
+DISPATCH_POLICIES = (DISPATCH_BLOCK, DISPATCH_DROP_OLDEST, DISPATCH_DROP_NEWEST)
+
+
+class _DispatchQueue:
+    __slots__ = ('items', 'scheduled', 'max_depth', 'processed', 'dropped', 'blocked')
+
+    def __init__(self):
+        self.items = deque()
+        self.scheduled = False
+        self.max_depth = 0
+        self.processed = 0
+        self.dropped = 0
+        self.blocked = 0
+
+
+class DTXDispatcher:
+
+    def __init__(self, workers=4, queue_size=256, policy=DISPATCH_BLOCK, batch=32):
+        """
+        :param workers: 线程数
+        :param queue_size: 每个 channel 队列的长度上限
+        :param policy: 队列满时的处理方式, DISPATCH_BLOCK / DISPATCH_DROP_OLDEST / DISPATCH_DROP_NEWEST
+        :param batch: 一个 channel 连续处理的消息数, 之后让出线程给其他 channel
+        """
+        if policy not in DISPATCH_POLICIES:
+            raise ValueError(f"unknown dispatch policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.batch = batch
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="InstrumentDispatch")
+        self._cond = Condition()
+        self._queues = {}
+        self._closed = False
+
+    def submit(self, key, func, *args) -> bool:
+        """
+        把 func(*args) 放入 key 对应的队列
+        :return: bool 是否被接受, DISPATCH_DROP_NEWEST 策略下队列已满, 或已关闭 (包括 DISPATCH_BLOCK 等待期间关闭) 时返回 False
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = _DispatchQueue()
+            if len(queue.items) >= self.queue_size:
+                if self.policy == DISPATCH_DROP_NEWEST:
+                    queue.dropped += 1
+                    return False
+                if self.policy == DISPATCH_DROP_OLDEST:
+                    queue.items.popleft()
+                    queue.dropped += 1
+                else:
+                    queue.blocked += 1
+                    while len(queue.items) >= self.queue_size and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        # 等待期间 dispatcher 已关闭, 线程池不再接受任务
+                        queue.dropped += 1
+                        return False
+            queue.items.append((func, args))
+            queue.max_depth = max(queue.max_depth, len(queue.items))
+            if not queue.scheduled:
+                queue.scheduled = True
+                self._pool.submit(self._drain, queue)
+        return True
+
+    def _drain(self, queue: _DispatchQueue):
+        while 1:
+            for _ in range(self.batch):
+                with self._cond:
+                    if not queue.items:
+                        queue.scheduled = False
+                        return
+                    if len(queue.items) >= self.queue_size:
+                        self._cond.notify_all()
+                    func, args = queue.items.popleft()
+                try:
+                    func(*args)
+                except:
+                    traceback.print_exc()
+                queue.processed += 1
+            with self._cond:
+                if not queue.items:
+                    queue.scheduled = False
+                    return
+                if not self._closed:
+                    self._pool.submit(self._drain, queue)
+                    return
+
+    def stats(self) -> dict:
+        """
+        :return: {key: {depth, max_depth, processed, dropped, blocked}}, blocked 为接收线程因队列满而等待的次数
+        """
+        with self._cond:
+            return {key: {
+                'depth': len(queue.items),
+                'max_depth': queue.max_depth,
+                'processed': queue.processed,
+                'dropped': queue.dropped,
+                'blocked': queue.blocked,
+            } for key, queue in self._queues.items()}
+
+    def shutdown(self, wait=True):
+        """
+        停止接受新消息, wait 为 True 时等待已经入队的消息处理完
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait)
@@ -9,59 +9,128 @@ dtx msg 分为几层，按顺序
 
 """
 import struct
-from ctypes import Structure, \
-    c_uint32, c_uint16, c_uint64, c_int64, sizeof
+from functools import lru_cache
+
 from instrument.bpylist.bplistlib.readwrite import load
 
 from instrument.bpylist import archiver
 
 
+DTX_FRAGMENT_SIZE = 65504
+
+
 def div_ceil(p: int, q: int) -> int:
     return (p + q - 1) // q
 
 
-class DTXMessageHeader(Structure):
-    _fields_ = [
-        ('magic', c_uint32),
-        ('cb', c_uint32),
-        ('fragmentId', c_uint16),
-        ('fragmentCount', c_uint16),
-        ('length', c_uint32),
-        ('identifier', c_uint32),
-        ('conversationIndex', c_uint32),
-        ('channelCode', c_uint32),
-        ('expectsReply', c_uint32)
-    ]
+def _split_buffers(buffers, size):
+    """ 把 buffer 列表按 size 切分, 每一段以 memoryview 列表的形式返回, 不拷贝数据 """
+    chunks, chunks_len = [], 0
+    for buf in buffers:
+        view = memoryview(buf)
+        while view:
+            n = min(size - chunks_len, len(view))
+            chunks.append(view[:n])
+            chunks_len += n
+            view = view[n:]
+            if chunks_len == size:
+                yield chunks, chunks_len
+                chunks, chunks_len = [], 0
+    if chunks:
+        yield chunks, chunks_len
+
+
+class DTXMessageHeader:
+    """ DTX 消息头, 32 字节, 使用预编译的 struct.Struct 编解码 """
+    __slots__ = ('magic', 'cb', 'fragmentId', 'fragmentCount', 'length', 'identifier', 'conversationIndex',
+                 'channelCode', 'expectsReply')
+    _struct = struct.Struct('<IIHHIIIII')
+    size = _struct.size
 
     def __init__(self):
-        super().__init__()
         self.magic = 0x1f3d5b79
-        self.cb = sizeof(DTXMessageHeader)
+        self.cb = self.size
         self.fragmentId = 0
         self.fragmentCount = 1
+        self.length = 0
+        self.identifier = 0
+        self.conversationIndex = 0
+        self.channelCode = 0
+        self.expectsReply = 0
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        ret = object.__new__(cls)
+        (ret.magic, ret.cb, ret.fragmentId, ret.fragmentCount, ret.length, ret.identifier, ret.conversationIndex,
+         ret.channelCode, ret.expectsReply) = cls._struct.unpack_from(buffer, offset)
+        return ret
+
+    from_buffer_copy = unpack_from
 
+    def pack_into(self, buffer, offset=0):
+        self._struct.pack_into(buffer, offset, self.magic, self.cb, self.fragmentId, self.fragmentCount, self.length,
+                               self.identifier, self.conversationIndex, self.channelCode, self.expectsReply)
 
-class DTXMessagePayloadHeader(Structure):
-    _fields_ = [
-        ('flags', c_uint32),
-        ('auxiliaryLength', c_uint32),
-        ('totalLength', c_uint64)
-    ]
+    def __bytes__(self):
+        return self._struct.pack(self.magic, self.cb, self.fragmentId, self.fragmentCount, self.length,
+                                 self.identifier, self.conversationIndex, self.channelCode, self.expectsReply)
+
+    def copy(self):
+        ret = object.__new__(DTXMessageHeader)
+        (ret.magic, ret.cb, ret.fragmentId, ret.fragmentCount, ret.length, ret.identifier, ret.conversationIndex,
+         ret.channelCode, ret.expectsReply) = (self.magic, self.cb, self.fragmentId, self.fragmentCount, self.length,
+                                               self.identifier, self.conversationIndex, self.channelCode,
+                                               self.expectsReply)
+        return ret
+
+
+class DTXMessagePayloadHeader:
+    __slots__ = ('flags', 'auxiliaryLength', 'totalLength')
+    _struct = struct.Struct('<IIQ')
+    size = _struct.size
 
     def __init__(self):
-        super().__init__()
         self.flags = 0x2
+        self.auxiliaryLength = 0
+        self.totalLength = 0
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        ret = object.__new__(cls)
+        ret.flags, ret.auxiliaryLength, ret.totalLength = cls._struct.unpack_from(buffer, offset)
+        return ret
 
+    from_buffer_copy = unpack_from
 
-class DTXAuxiliariesHeader(Structure):
-    _fields_ = [
-        ('magic', c_uint64),
-        ('length', c_int64)
-    ]
+    def pack_into(self, buffer, offset=0):
+        self._struct.pack_into(buffer, offset, self.flags, self.auxiliaryLength, self.totalLength)
+
+    def __bytes__(self):
+        return self._struct.pack(self.flags, self.auxiliaryLength, self.totalLength)
+
+
+class DTXAuxiliariesHeader:
+    __slots__ = ('magic', 'length')
+    _struct = struct.Struct('<Qq')
+    size = _struct.size
 
     def __init__(self):
-        super().__init__()
         self.magic = 0x1f0
+        self.length = 0
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        ret = object.__new__(cls)
+        ret.magic, ret.length = cls._struct.unpack_from(buffer, offset)
+        return ret
+
+    from_buffer_copy = unpack_from
+
+    def pack_into(self, buffer, offset=0):
+        self._struct.pack_into(buffer, offset, self.magic, self.length)
+
+    def __bytes__(self):
+        return self._struct.pack(self.magic, self.length)
 
 
 class DTXMessage:
@@ -72,6 +141,7 @@ class DTXMessage:
         self._auxiliaries_header = None
         self._selector = b''
         self._auxiliaries = []
+        self._decoded_auxiliaries = {}
 
     def _init_payload_header(self):
         """ 构造 DTXMessagePayload 头部
@@ -80,15 +150,15 @@ class DTXMessage:
         if self._payload_header is None:
             self._payload_header = DTXMessagePayloadHeader()
             self._payload_header.totalLength = 0
-            self._message_header.length += sizeof(DTXMessagePayloadHeader)
+            self._message_header.length += DTXMessagePayloadHeader.size
 
     def _init_auxiliaries_header(self):
         self._init_payload_header()
         if self._auxiliaries_header is None:
             self._auxiliaries_header = DTXAuxiliariesHeader()
-            self._payload_header.totalLength += sizeof(DTXAuxiliariesHeader)
-            self._payload_header.auxiliaryLength += sizeof(DTXAuxiliariesHeader)
-            self._message_header.length += sizeof(DTXAuxiliariesHeader)
+            self._payload_header.totalLength += DTXAuxiliariesHeader.size
+            self._payload_header.auxiliaryLength += DTXAuxiliariesHeader.size
+            self._message_header.length += DTXAuxiliariesHeader.size
 
     def _update_auxiliary_len(self, delta):
         self._message_header.length += delta
@@ -103,98 +173,166 @@ class DTXMessage:
         pass
 
     @classmethod
-    def from_bytes(self, buffer: bytes):
+    def from_bytes(self, buffer, strict: bool = False):
+        """ 解析一条完整的 DTX 消息
+        buffer 可以是 bytes / bytearray / memoryview, 解析过程只在 memoryview 上移动游标,
+        selector 与 auxiliary 以 memoryview 的形式引用原始 buffer, 调用 get_selector / get_auxiliary_at 时才生成 bytes
+        :param buffer: 包含所有 fragment 的接收 buffer
+        :param strict: 是否重新序列化并与原始 buffer 比对, 仅用于调试协议解析问题
+        :return: DTXMessage
+        """
         cursor = 0
         ret = DTXMessage()
         backup_buf = buffer
         ret._buf = buffer
-        payload_buf = b''
-        ret._message_header = DTXMessageHeader.from_buffer_copy(buffer[cursor:cursor + sizeof(DTXMessageHeader)])
-        cursor = sizeof(DTXMessageHeader)
+        view = memoryview(buffer)
+        ret._message_header = DTXMessageHeader.unpack_from(view, cursor)
+        cursor = DTXMessageHeader.size
         has_payload = ret._message_header.length > 0
         if not has_payload:
             return ret
 
-        if ret._message_header.length != len(buffer) - cursor - (ret._message_header.fragmentCount - 1) * sizeof(
-                DTXMessageHeader):
+        if ret._message_header.length != len(view) - cursor - (ret._message_header.fragmentCount - 1) * \
+                DTXMessageHeader.size:
             raise ValueError("incorrect DTXMessageHeader->length")
 
         if ret._message_header.fragmentCount == 1:
-            payload_buf = buffer[cursor:]
+            payload = view[cursor:]
         else:
             assert ret._message_header.fragmentCount >= 3
-            while cursor < len(buffer):
-                subhdr = DTXMessageHeader.from_buffer_copy(buffer[cursor: cursor + sizeof(DTXMessageHeader)])
-                cursor += sizeof(DTXMessageHeader)
-                assert len(buffer[cursor: cursor + subhdr.length]) == subhdr.length
-                payload_buf += buffer[cursor: cursor + subhdr.length]
+            # 多个 fragment 的 payload 不连续, 一次性分配后按偏移拷贝, 避免 bytes 反复拼接
+            payload_buf = bytearray(ret._message_header.length)
+            offset = 0
+            while cursor < len(view):
+                subhdr = DTXMessageHeader.unpack_from(view, cursor)
+                cursor += DTXMessageHeader.size
+                assert cursor + subhdr.length <= len(view)
+                payload_buf[offset: offset + subhdr.length] = view[cursor: cursor + subhdr.length]
+                offset += subhdr.length
                 cursor += subhdr.length
-                # print(subhdr.magic, subhdr.fragmentCount, subhdr.fragmentId, subhdr.length)
                 assert subhdr.magic == ret._message_header.magic
-            assert cursor == len(buffer)
-        buffer = payload_buf
+            assert cursor == len(view)
+            payload = memoryview(payload_buf)
+        ret._parse_payload(payload)
+        if strict and ret.to_bytes() != backup_buf:
+            raise ValueError("DTXMessage round-trip mismatch")
+        return ret
+
+    def _parse_payload(self, payload: memoryview):
+        """ 解析 DTXMessagePayloadHeader 之后的数据, auxiliary 与 selector 只保存 payload 上的切片
+        :param payload: 已拼接好的 payload
+        :return:
+        """
         cursor = 0
-        ret._payload_header = DTXMessagePayloadHeader.from_buffer_copy(
-            buffer[cursor:cursor + sizeof(DTXMessagePayloadHeader)])
-        cursor += sizeof(DTXMessagePayloadHeader)
-        if ret._payload_header.totalLength == 0:
-            return ret
-        if ret._payload_header.totalLength != len(buffer) - cursor:
+        self._payload_header = DTXMessagePayloadHeader.unpack_from(payload, cursor)
+        cursor += DTXMessagePayloadHeader.size
+        if self._payload_header.totalLength == 0:
+            return
+        if self._payload_header.totalLength != len(payload) - cursor:
             raise ValueError("incorrect DTXPayloadHeader->totalLength")
-        if ret._payload_header.auxiliaryLength:
-            ret._auxiliaries_header = DTXAuxiliariesHeader.from_buffer_copy(
-                buffer[cursor:cursor + sizeof(DTXAuxiliariesHeader)])
-            cursor += sizeof(DTXAuxiliariesHeader)
+        if self._payload_header.auxiliaryLength:
+            self._auxiliaries_header = DTXAuxiliariesHeader.unpack_from(payload, cursor)
+            cursor += DTXAuxiliariesHeader.size
             i = 0
-            while i < ret._auxiliaries_header.length:
-                m, t = struct.unpack("<II", buffer[cursor + i: cursor + i + 8])
+            while i < self._auxiliaries_header.length:
+                m, t = struct.unpack_from("<II", payload, cursor + i)
                 if m != 0xa:  # magic
                     raise ValueError("incorrect auxiliary magic")
                 if t == 2:  # CFStringRef
-                    l, = struct.unpack("<I", buffer[cursor + i + 8: cursor + i + 12])
-                    ret._auxiliaries.append(buffer[cursor + i: cursor + i + 12 + l])
+                    l, = struct.unpack_from("<I", payload, cursor + i + 8)
+                    self._auxiliaries.append(payload[cursor + i: cursor + i + 12 + l])
                     i += 12 + l
                 elif t == 3:  # int32_t
-                    ret._auxiliaries.append(buffer[cursor + i: cursor + i + 12])
+                    self._auxiliaries.append(payload[cursor + i: cursor + i + 12])
                     i += 12
                 elif t == 4:  # int64_t
-                    ret._auxiliaries.append(buffer[cursor + i: cursor + i + 16])
+                    self._auxiliaries.append(payload[cursor + i: cursor + i + 16])
                     i += 16
                 elif t == 6:
-                    ret._auxiliaries.append(buffer[cursor + i: cursor + i + 16])
+                    self._auxiliaries.append(payload[cursor + i: cursor + i + 16])
                     i += 16
                 else:
                     raise ValueError("unknown auxiliary type")
-            if i != ret._auxiliaries_header.length:
+            if i != self._auxiliaries_header.length:
                 raise ValueError("incorrect DTXAuxiliariesHeader.length")
-            cursor += ret._auxiliaries_header.length
-        ret._selector = buffer[cursor:]
-        assert ret.to_bytes() == backup_buf, "correctness check"
+            cursor += self._auxiliaries_header.length
+        self._selector = payload[cursor:]
+
+    @classmethod
+    def from_payload(self, header: DTXMessageHeader, payload, strict: bool = False):
+        """ 由已经重组好的 payload 构造 DTXMessage, 不再重新解析 fragment header
+        :param header: 第一个 fragment 的 DTXMessageHeader
+        :param payload: 所有 fragment body 按顺序拼接后的数据, 长度为 header.length
+        :param strict: 是否重新序列化 payload 并与原始数据比对
+        :return: DTXMessage
+        """
+        ret = DTXMessage()
+        ret._message_header = header
+        if header.length == 0:
+            ret._buf = bytes(header)
+            return ret
+        if header.length != len(payload):
+            raise ValueError("incorrect DTXMessageHeader->length")
+        ret._parse_payload(memoryview(payload))
+        if strict and ret._payload_to_bytes() != payload:
+            raise ValueError("DTXMessage round-trip mismatch")
+        return ret
+
+    def _payload_buffers(self, reserved: int = 0) -> list:
+        """ payload 的各个组成部分, 不做拼接
+        :param reserved: 在第一个 buffer 的 payload header 之前预留的字节数
+        :return: list
+        """
+        headers_len = DTXMessagePayloadHeader.size
+        if self._auxiliaries_header:
+            headers_len += DTXAuxiliariesHeader.size
+        headers = bytearray(reserved + headers_len)
+        self._payload_header.pack_into(headers, reserved)
+        buffers = [headers]
+        if self._auxiliaries_header:
+            self._auxiliaries_header.pack_into(headers, reserved + DTXMessagePayloadHeader.size)
+            buffers.extend(self._auxiliaries)
+        buffers.append(self._selector)
+        return buffers
+
+    def _payload_to_bytes(self) -> bytes:
+        return b''.join(self._payload_buffers())
+
+    def to_buffers(self) -> list:
+        """ 返回组成整条消息的 buffer 列表(header, payload header, auxiliaries, selector 以及 fragment header),
+        auxiliary 与 selector 不会被拷贝, 可以直接交给 socket.sendmsg 发送
+        :return: list
+        """
+        if not self._payload_header:
+            return [self._buf]
+        buffers = self._payload_buffers(DTXMessageHeader.size)
+        payload_len = sum(map(len, buffers)) - DTXMessageHeader.size
+        if payload_len <= DTX_FRAGMENT_SIZE:
+            self._message_header.fragmentCount = 1
+            self._message_header.pack_into(buffers[0])
+            return buffers
+
+        parts = div_ceil(payload_len, DTX_FRAGMENT_SIZE)
+        self._message_header.fragmentCount = parts + 1
+        headers = bytearray((parts + 1) * DTXMessageHeader.size)
+        headers_view = memoryview(headers)
+        self._message_header.pack_into(headers)
+        payload = [memoryview(buffers[0])[DTXMessageHeader.size:]] + buffers[1:]
+        ret = [headers_view[:DTXMessageHeader.size]]
+        subhdr = self._message_header.copy()
+        for part, (chunks, part_len) in enumerate(_split_buffers(payload, DTX_FRAGMENT_SIZE)):
+            offset = (part + 1) * DTXMessageHeader.size
+            subhdr.fragmentId = part + 1
+            subhdr.length = part_len
+            subhdr.pack_into(headers, offset)
+            ret.append(headers_view[offset: offset + DTXMessageHeader.size])
+            ret.extend(chunks)
         return ret
 
     def to_bytes(self) -> bytes:
         if not self._payload_header:
             return self._buf
-        payload_buf = b''
-        payload_buf += bytes(self._payload_header)
-        if self._auxiliaries_header:
-            payload_buf += bytes(self._auxiliaries_header)
-            if self._auxiliaries:
-                payload_buf += b''.join(self._auxiliaries)
-        payload_buf += self._selector
-        if len(payload_buf) > 65504:
-            parts = div_ceil(len(payload_buf), 65504)
-            self._message_header.fragmentCount = parts + 1
-            self._buf = bytes(self._message_header)
-            for part in range(parts):
-                part_len = min(len(payload_buf) - part * 65504, 65504)
-                subhdr = DTXMessageHeader.from_buffer_copy(bytes(self._message_header))
-                subhdr.fragmentId = part + 1
-                subhdr.length = part_len
-                self._buf += bytes(subhdr)
-                self._buf += payload_buf[part * 65504: part * 65504 + part_len]
-        else:
-            self._buf = bytes(self._message_header) + payload_buf
+        self._buf = b''.join(self.to_buffers())
         return self._buf
 
     def set_selector(self, buffer: bytes):
@@ -204,8 +342,14 @@ class DTXMessage:
         return self
 
     def get_selector(self) -> bytes:
+        if type(self._selector) is memoryview:
+            self._selector = self._selector.tobytes()
         return self._selector
 
+    def get_selector_view(self) -> memoryview:
+        """ 不拷贝数据, 返回 selector 在接收 buffer 上的视图 """
+        return memoryview(self._selector)
+
     def add_auxiliary(self, buffer: bytes):
         self._init_auxiliaries_header()
         self._update_auxiliary_len(len(buffer))
@@ -216,8 +360,27 @@ class DTXMessage:
         return len(self._auxiliaries)
 
     def get_auxiliary_at(self, idx: int) -> bytes:
+        if type(self._auxiliaries[idx]) is memoryview:
+            self._auxiliaries[idx] = self._auxiliaries[idx].tobytes()
         return self._auxiliaries[idx]
 
+    def aux(self, idx: int):
+        """ 按需解码第 idx 个 auxiliary(int32/int64/type 6/CFTypeRef), 解码结果会被缓存
+        只读取整型参数时不会触发 NSKeyedArchive 解码
+        :param idx: auxiliary 下标
+        :return: 解码后的 python 对象
+        """
+        if idx in self._decoded_auxiliaries:
+            return self._decoded_auxiliaries[idx]
+        obj = auxiliary_to_pyobject(self._auxiliaries[idx])
+        self._decoded_auxiliaries[idx] = obj
+        return obj
+
+    def iter_aux(self):
+        """ 依次按需解码所有 auxiliary """
+        for idx in range(len(self._auxiliaries)):
+            yield self.aux(idx)
+
     def new_reply(self):
         ret = DTXMessage()
         ret.channel_code = self.channel_code
@@ -261,10 +424,28 @@ class DTXMessage:
         self._message_header.expectsReply = 1 if expect else 0
 
 
+# 不可变的值归档结果固定, 可以缓存; 容器类型每次重新归档
+# float 不缓存: 0.0 == -0.0 且哈希相同, 会互相命中对方的归档结果
+_ARCHIVE_CACHEABLE_TYPES = (str, bool, bytes)
+
+
+@lru_cache(maxsize=512, typed=True)
+def _cached_archive(obj) -> bytes:
+    return archiver.archive(obj)
+
+
 def ns_keyed_archiver(obj):
+    if type(obj) in _ARCHIVE_CACHEABLE_TYPES:
+        return _cached_archive(obj)
     return archiver.archive(obj)
 
 
+@lru_cache(maxsize=512, typed=True)
+def _cached_object_auxiliary(var) -> bytes:
+    buf = archiver.archive(var)
+    return struct.pack('<iii', 0xa, 2, len(buf)) + buf
+
+
 def pyobject_to_auxiliary(var):
     if type(var) is int:
         if abs(var) < 2 ** 32:
@@ -273,6 +454,8 @@ def pyobject_to_auxiliary(var):
             return struct.pack('<iiq', 0xa, 4, var)
         else:
             raise ValueError("num too large")
+    elif type(var) in _ARCHIVE_CACHEABLE_TYPES:
+        return _cached_object_auxiliary(var)
     else:
         buf = ns_keyed_archiver(var)
         return struct.pack('<iii', 0xa, 2, len(buf)) + buf
@@ -285,7 +468,7 @@ def auxiliary_to_pyobject(aux):
     if t == 2:  # CFTypeRef object
         l, = struct.unpack("<i", aux[8: 12])
         assert len(aux) == 12 + l, "bad auxiliary"
-        return archiver.unarchive(aux[12:])
+        return archiver.unarchive(bytes(aux[12:]))
     elif t == 3:  # int32_t
         n, = struct.unpack("<i", aux[8:12])
         return n
@@ -300,18 +483,18 @@ def auxiliary_to_pyobject(aux):
 
 
 def pyobject_to_selector(s):
-    return archiver.archive(s)
+    return ns_keyed_archiver(s)
 
 
 def selector_to_pyobject(sel):
     if not sel:
         return None
-    return archiver.unarchive(sel)
+    return archiver.unarchive(bytes(sel))
 
 
 if __name__ == '__main__':
     buf = b'y[=\x1f \x00\x00\x00\x00\x00\x01\x00\x9c\x00\x00\x00\x03\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x8c\x00\x00\x00\x00\x00\x00\x00bplist00\xd4\x01\x02\x03\x04\x05\x06\t\nX$versionX$objectsY$archiverT$top\x12\x00\x01\x86\xa0\xa2\x07\x08U$null\x11\xda\x92_\x10\x0fNSKeyedArchiver\xd1\x0b\x0cTroot\x80\x01\x08\x11\x1a#-27:@CUX]\x00\x00\x00\x00\x00\x00\x01\x01\x00\x00\x00\x00\x00\x00\x00\r\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00_'
-    p = DTXMessage.from_bytes(buf)
+    p = DTXMessage.from_bytes(buf, strict=True)
 
     print(p)
     print(load(p.get_selector()))
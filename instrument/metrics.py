@@ -0,0 +1,55 @@
+"""
+rpc 调用耗时统计
+"""
+import bisect
+
+# 分桶上限, 秒
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+class LatencyHistogram:
+    """
+    固定分桶的耗时直方图, 记录一次只需要一次二分查找, 可以常开
+    """
+    __slots__ = ('counts', 'count', 'total', 'max', 'timeouts')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: 0 ~ 100
+        :return: 第 q 百分位所在分桶的上限, 秒, 落在最后一个分桶时返回最大值
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * q / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'timeouts': self.timeouts,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(zip(LATENCY_BUCKETS + (float('inf'),), self.counts)),
+        }
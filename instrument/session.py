@@ -0,0 +1,204 @@
+"""
+多设备会话管理: 每个 udid 保持一个 lockdown 会话与一个 instrument 连接, 在多个任务之间复用
+所有设备的 I/O 跑在同一个事件循环线程中, lockdown / usbmux 的阻塞调用在有界线程池中执行:
+    with InstrumentSessionManager() as manager:
+        processes = manager.call(udid, "com.apple.instruments.server.services.deviceinfo", "runningProcesses").parsed
+        future = manager.submit(udid, job)  # async def job(session): ...
+        print(manager.stats())
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import Thread
+
+from instrument.aio import AsyncInstrumentRPC, open_instrument_stream, pre_call
+from instrument.metrics import LatencyHistogram
+from util import logging
+from util.exceptions import InstrumentRPCTimeoutError
+from util.lockdown import LockdownClient
+
+log = logging.getLogger(__name__)
+
+
+class DeviceSession:
+    """
+    一台设备的会话, 连接断开后由 InstrumentSessionManager 在下一次使用时重新建立
+    """
+
+    def __init__(self, udid):
+        self.udid = udid
+        self.lockdown = None
+        self.rpc = None
+        self.opened_at = None
+        self.opens = 0
+        self.jobs = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self._frames = 0  # 之前的连接接收的 frame 数
+        self._lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.rpc is not None and not self.rpc._receiver_exiting
+
+    async def call(self, channel: str, selector: str, *auxiliaries):
+        """
+        与 AsyncInstrumentRPC.call 相同, 同时记录调用耗时
+        """
+        begin = time.perf_counter()
+        try:
+            return await self.rpc.call(channel, selector, *auxiliaries)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latency.record(time.perf_counter() - begin)
+
+    async def close(self):
+        if self.rpc:
+            self._frames += self.rpc.frames_received
+            await self.rpc.deinit()
+            self.rpc = None
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self.opened_at if self.opened_at else 0.0
+        frames = self._frames + (self.rpc.frames_received if self.rpc else 0)
+        return {
+            'alive': self.alive,
+            'opens': self.opens,
+            'jobs': self.jobs,
+            'errors': self.errors,
+            'uptime': uptime,
+            'frames': frames,
+            'frames_per_sec': frames / uptime if uptime else 0.0,
+            'calls_per_sec': self.latency.count / uptime if uptime else 0.0,
+            'latency': self.latency.to_dict(),
+        }
+
+
+class InstrumentSessionManager:
+
+    def __init__(self, max_workers=8):
+        """
+        :param max_workers: 执行 lockdown / usbmux 阻塞调用的线程数
+        """
+        self.max_workers = max_workers
+        self.loop = None
+        self._thread = None
+        self._executor = None
+        self._sessions = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """
+        启动事件循环线程
+        """
+        if self.loop:
+            return
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="InstrumentSession")
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self._executor)
+        self._thread = Thread(target=self.loop.run_forever, name="InstrumentSessionLoop", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        关闭所有会话并停止事件循环
+        """
+        if not self.loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self._executor.shutdown()
+        self.loop = None
+
+    async def session(self, udid=None) -> DeviceSession:
+        """
+        获取 udid 对应的会话, 不存在或连接已断开时建立连接, 需要在管理器的事件循环中调用
+        :return: DeviceSession
+        """
+        session = self._sessions.get(udid)
+        if session is None:
+            session = self._sessions[udid] = DeviceSession(udid)
+        async with session._lock:
+            if not session.alive:
+                await self._open(session)
+        return session
+
+    async def _open(self, session: DeviceSession):
+        await session.close()
+        try:
+            session.rpc = await self._connect(session)
+        except Exception:
+            session.lockdown = None  # lockdown 连接可能已经失效, 下次重新建立
+            raise
+        await pre_call(session.rpc)
+        session.opens += 1
+        if session.opened_at is None:
+            session.opened_at = time.monotonic()
+        log.debug("instrument session opened: %s", session.udid)
+
+    async def _connect(self, session: DeviceSession) -> AsyncInstrumentRPC:
+        """
+        建立 instrument 连接, 复用会话中的 lockdown
+        """
+        if session.lockdown is None:
+            session.lockdown = await self.loop.run_in_executor(None, lambda: LockdownClient(udid=session.udid))
+        reader, writer = await open_instrument_stream(session.lockdown)
+        rpc = AsyncInstrumentRPC(session.udid)
+        rpc.lockdown = session.lockdown
+        rpc.init_stream(reader, writer)
+        return rpc
+
+    def submit(self, udid, job):
+        """
+        在事件循环中执行任务, 可以在任意线程调用
+        :param udid: 设备 udid
+        :param job: 协程函数, 接受一个参数, 类型是 DeviceSession
+        :return: concurrent.futures.Future, 结果为 job 的返回值
+        """
+        return asyncio.run_coroutine_threadsafe(self._run(udid, job), self.loop)
+
+    async def _run(self, udid, job):
+        session = await self.session(udid)
+        session.jobs += 1
+        return await job(session)
+
+    def call(self, udid, channel: str, selector: str, *auxiliaries, timeout=None):
+        """
+        阻塞调用, 可以在任意线程调用
+        :param timeout: 超时时间, 秒, 超时后取消调用并抛出 InstrumentRPCTimeoutError
+        :return: InstrumentRPCResult
+        """
+        future = self.submit(udid, lambda session: session.call(channel, selector, *auxiliaries))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()  # 取消事件循环中的任务, 避免无响应的设备上任务堆积
+            raise InstrumentRPCTimeoutError(f"no reply for {selector} from {udid} in {timeout}s")
+
+    def stats(self) -> dict:
+        """
+        获取每台设备的统计: 连接次数, 任务数, 失败的调用数, 接收的 frame 数与速率, 调用速率与耗时分布
+        :return: {udid: dict}
+        """
+        return asyncio.run_coroutine_threadsafe(self._stats(), self.loop).result()
+
+    async def _stats(self):
+        return {udid: session.stats() for udid, session in self._sessions.items()}
+
+    async def _close_all(self):
+        for session in self._sessions.values():
+            try:
+                await session.close()
+            except Exception as E:
+                log.debug(E)
+        self._sessions.clear()
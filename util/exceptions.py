@@ -56,6 +56,14 @@ class NoMuxDeviceFound(MuxError):
     pass
 
 
+class InstrumentRPCException(PyPodException):
+    pass
+
+
+class InstrumentRPCTimeoutError(InstrumentRPCException, TimeoutError):
+    pass
+
+
 class iOSError(PyPodException, OSError):
     """Generic exception for AFC errors or errors that would normally be raised by the OS"""
     def __init__(self, errno=None, afc_errno=AFC_E_UNKNOWN_ERROR, *args, **kwargs):
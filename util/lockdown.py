@@ -166,6 +166,13 @@ class LockdownClient:
         return resp
 
     def start_service(self, name: str, escrow_bag=None) -> PlistService:
+        resp = self.start_service_info(name, escrow_bag)
+        plist_service = PlistService(
+            resp.get('Port'), self.udid, ssl_file=self.sslfile if resp.get('EnableServiceSSL', False) else None
+        )
+        return plist_service
+
+    def start_service_info(self, name: str, escrow_bag=None) -> dict:
         if not self.paired:
             raise NotPairedError(f'Unable to start service={name!r} - not paired')
         elif not name:
@@ -180,11 +187,7 @@ class LockdownClient:
                 raise StartServiceError(f'Unable to start service={name!r} - a password must be entered on the device')
             error = resp.get('Error')
             raise StartServiceError(f'Unable to start service={name!r} - {error}')
-
-        plist_service = PlistService(
-            resp.get('Port'), self.udid, ssl_file=self.sslfile if resp.get('EnableServiceSSL', False) else None
-        )
-        return plist_service
+        return resp
 
     def stop_session(self):
         if self.session_id and self.svc:
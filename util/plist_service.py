@@ -10,6 +10,7 @@ from socket import socket
 from typing import Optional, Dict, Any
 
 from .usbmux import USBMux, MuxDevice
+from .utils import sendmsg_all
 
 __all__ = ['PlistService']
 log = logging.getLogger(__name__)
@@ -44,6 +45,15 @@ class PlistService:
             log.debug('sock: None ')
             return b''
 
+    def recv_into(self, buffer, timeout=-1) -> int:
+        try:
+            if timeout > 0:
+                self.sock.settimeout(timeout)
+            return self.sock.recv_into(buffer)
+        except Exception as E:
+            log.debug('sock: None ')
+            return 0
+
     def close(self):
         self.sock.close()
 
@@ -84,7 +94,7 @@ class PlistService:
         payload = plistlib.dumps(data)
         log.debug(f'发送 Plist byte: {payload}')
         payload_len = struct.pack('>L', len(payload))
-        return self.sock.send(payload_len + payload)
+        return sendmsg_all(self.sock, [payload_len, payload])
 
     def plist_request(self, request):
         self.send_plist(request)
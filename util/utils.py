@@ -1,9 +1,12 @@
 """
 Utils
 """
+import socket
+import ssl
 
-__all__ = ['DictAttrProperty', 'DictAttrFieldNotFoundError']
+__all__ = ['DictAttrProperty', 'DictAttrFieldNotFoundError', 'sendmsg_all']
 _NotSet = object()
+SENDMSG_MAX_BUFFERS = 1024  # IOV_MAX
 
 
 class cached_property(object):
@@ -97,3 +100,39 @@ class DictAttrFieldNotFoundError(Exception):
     def __str__(self):
         fmt = '{!r} object has no attribute {!r} ({} not found in {!r}.{})'
         return fmt.format(type(self.obj).__name__, self.prop_name, self.path_repr, self.obj, self.attr)
+
+
+def _get_sendmsg(sock):
+    if isinstance(sock, ssl.SSLSocket):
+        # SSLSocket 禁用了 sendmsg, 明文通道(_sslobj 为 None)可以直接使用底层 socket 的实现
+        if getattr(sock, '_sslobj', None) is not None:
+            return None
+        return lambda buffers: socket.socket.sendmsg(sock, buffers)
+    return getattr(sock, 'sendmsg', None)
+
+
+def sendmsg_all(sock, buffers) -> int:
+    """
+    使用 socket.sendmsg 一次发送多个 buffer, 循环处理部分写入, 直到所有数据都被发出
+    不支持 sendmsg 的 socket (Windows, 加密的 SSL 通道) 拼接后使用 sendall 发送
+    :param sock: socket
+    :param buffers: bytes / bytearray / memoryview 列表
+    :return: 发送的字节数
+    """
+    views = [memoryview(buf).cast('B') for buf in buffers if len(buf)]
+    total = sum(len(view) for view in views)
+    sendmsg = _get_sendmsg(sock)
+    if sendmsg is None:
+        sock.sendall(b''.join(views))
+        return total
+    index = 0
+    while index < len(views):
+        sent = sendmsg(views[index: index + SENDMSG_MAX_BUFFERS])
+        while sent:
+            if sent >= len(views[index]):
+                sent -= len(views[index])
+                index += 1
+            else:
+                views[index] = views[index][sent:]
+                sent = 0
+    return total